@@ -1,10 +1,12 @@
 import streamlit as st
 import os
+import queue
+import threading
 from pathlib import Path
-import hashlib
+import blake3
 from datetime import datetime
 from document_processor import DocumentProcessor
-from vector_store import VectorStore
+from vector_store import get_vector_store
 from rag_engine import RAGEngine
 from data_visualizer import DataVisualizer
 from ocr_processor import OCRProcessor
@@ -16,23 +18,48 @@ st.set_page_config(
     layout="wide"
 )
 
+class LazyResource:
+    """Build a session object the first time it is needed
+
+    The processors, vector store and OpenAI clients are not needed to draw
+    the first page, so they are built on first use rather than on session
+    start.
+    """
+    
+    def __init__(self, factory):
+        self.factory = factory
+        self.obj = None
+    
+    def get(self):
+        if self.obj is None:
+            self.obj = self.factory()
+        return self.obj
+
 # Initialize session state
 if 'messages' not in st.session_state:
     st.session_state.messages = []
 if 'documents' not in st.session_state:
     st.session_state.documents = []
+if 'doc_hashes' not in st.session_state:
+    st.session_state.doc_hashes = set()
+if 'doc_names' not in st.session_state:
+    st.session_state.doc_names = set()
 if 'vector_store_ready' not in st.session_state:
     st.session_state.vector_store_ready = False
 if 'vector_store' not in st.session_state:
-    st.session_state.vector_store = VectorStore()
+    st.session_state.vector_store = LazyResource(get_vector_store)
 if 'ocr_processor' not in st.session_state:
-    st.session_state.ocr_processor = OCRProcessor()
+    st.session_state.ocr_processor = LazyResource(OCRProcessor)
 if 'doc_processor' not in st.session_state:
-    st.session_state.doc_processor = DocumentProcessor(ocr_processor=st.session_state.ocr_processor)
+    st.session_state.doc_processor = LazyResource(
+        lambda: DocumentProcessor(ocr_processor=st.session_state.ocr_processor.get())
+    )
 if 'rag_engine' not in st.session_state:
-    st.session_state.rag_engine = RAGEngine(st.session_state.vector_store)
+    st.session_state.rag_engine = LazyResource(
+        lambda: RAGEngine(st.session_state.vector_store.get())
+    )
 if 'visualizer' not in st.session_state:
-    st.session_state.visualizer = DataVisualizer()
+    st.session_state.visualizer = LazyResource(DataVisualizer)
 
 # Create necessary directories
 DATA_DIR = Path("data")
@@ -42,32 +69,65 @@ VECTOR_DB_DIR = Path("vectordb")
 for directory in [DATA_DIR, UPLOAD_DIR, VECTOR_DB_DIR]:
     directory.mkdir(exist_ok=True)
 
-def get_file_hash(file_bytes):
-    """Generate SHA256 hash for file"""
-    return hashlib.sha256(file_bytes).hexdigest()
+STATUS_EMOJI = {
+    'uploaded': '📤',
+    'processing': '⚙️',
+    'indexing': '⏳',
+    'indexed': '✅',
+    'failed_parsing': '❌',
+    'failed_indexing': '❌',
+    'error': '⚠️'
+}
+
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB
+
+# Process All pipeline: extracted documents wait in a bounded queue and are
+# indexed in batches of at least this many chunks (or whatever is ready)
+EXTRACT_QUEUE_SIZE = 4
+INDEX_BATCH_SIZE = 256
+
+# How often the Process button refreshes its status box while the
+# document is extracted and indexed on a worker thread
+STATUS_POLL_SECONDS = 0.25
+
+# Status box labels for the stages process_document goes through
+STAGE_LABELS = {
+    'processing': "Extracting text...",
+    'indexing': "Embedding and indexing chunks...",
+}
 
 def save_uploaded_file(uploaded_file):
-    """Save uploaded file and return file info"""
+    """Save uploaded file and return file info
+
+    The upload is streamed to a temporary file in fixed-size chunks while
+    it is hashed, so the full file never has to be held in memory.
+    """
+    file_path = DATA_DIR / uploaded_file.name
+    temp_path = DATA_DIR / f".{uploaded_file.name}.part"
     try:
-        file_bytes = uploaded_file.read()
-        file_hash = get_file_hash(file_bytes)
+        hasher = blake3.blake3(max_threads=blake3.blake3.AUTO)
+        size = 0
+        with open(temp_path, 'wb') as f:
+            while buf := uploaded_file.read(UPLOAD_CHUNK_SIZE):
+                hasher.update(buf)
+                f.write(buf)
+                size += len(buf)
+        file_hash = hasher.hexdigest()
         
         # Check for duplicates
-        for doc in st.session_state.documents:
-            if doc['hash'] == file_hash:
-                return None, "Duplicate file detected"
+        if file_hash in st.session_state.doc_hashes:
+            os.unlink(temp_path)
+            return None, "Duplicate file detected"
         
         # Save file
-        file_path = DATA_DIR / uploaded_file.name
-        with open(file_path, 'wb') as f:
-            f.write(file_bytes)
+        os.replace(temp_path, file_path)
         
         # Store document info
         doc_info = {
             'name': uploaded_file.name,
             'path': str(file_path),
             'hash': file_hash,
-            'size': len(file_bytes),
+            'size': size,
             'uploaded_at': datetime.now().isoformat(),
             'status': 'uploaded',
             'type': uploaded_file.type
@@ -75,66 +135,232 @@ def save_uploaded_file(uploaded_file):
         
         return doc_info, None
     except Exception as e:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
         return None, str(e)
 
-def process_document(doc_info):
-    """Process document and add to vector store"""
+def extract_and_chunk(doc_info, doc_processor=None):
+    """Extract text from a document and split it into indexable chunks
+
+    Returns (chunks, metadatas, ids), or None if the document could not be
+    parsed; failures are recorded on doc_info. The processor can be passed
+    in explicitly so this can run on worker threads, which don't have
+    access to st.session_state.
+    """
+    doc_processor = doc_processor or st.session_state.doc_processor.get()
     try:
         # Update status
         doc_info['status'] = 'processing'
         
         # Extract text
-        result = st.session_state.doc_processor.process_file(
+        result = doc_processor.process_file(
             doc_info['path'],
             doc_info['type']
         )
-        
+        return chunk_document(doc_info, result, doc_processor)
+            
+    except Exception as e:
+        doc_info['status'] = 'error'
+        doc_info['error'] = str(e)
+        return None
+
+def chunk_document(doc_info, result, doc_processor):
+    """Split a process_file result into indexable chunks
+
+    Returns (chunks, metadatas, ids), or None if the document could not be
+    parsed; failures are recorded on doc_info.
+    """
+    try:
         if result['status'] != 'success':
             doc_info['status'] = 'failed_parsing'
             doc_info['error'] = result.get('error', 'Unknown error')
-            return False
+            return None
         
         # Chunk text
-        chunks = st.session_state.doc_processor.chunk_text(result['text'])
+        chunks = doc_processor.chunk_text(result['text'])
         
         if not chunks:
             doc_info['status'] = 'failed_parsing'
             doc_info['error'] = 'No text extracted'
-            return False
+            return None
         
         # Create metadata for each chunk
-        metadatas = []
-        ids = []
-        for idx, chunk in enumerate(chunks):
-            metadata = {
-                'document_name': doc_info['name'],
+        name = doc_info['name']
+        uploaded_at = doc_info['uploaded_at']
+        ids = chunk_ids(doc_info, len(chunks))
+        metadatas = [
+            {
+                'document_name': name,
                 'chunk_id': idx,
                 'page': idx // 3 + 1,  # Approximate page number
-                'uploaded_at': doc_info['uploaded_at']
+                'uploaded_at': uploaded_at
             }
-            metadatas.append(metadata)
-            ids.append(f"{doc_info['hash']}_{idx}")
-        
-        # Add to vector store
-        success = st.session_state.vector_store.add_documents(
-            chunks=chunks,
-            metadatas=metadatas,
-            ids=ids
-        )
+            for idx in range(len(chunks))
+        ]
         
+        return chunks, metadatas, ids
+            
+    except Exception as e:
+        doc_info['status'] = 'error'
+        doc_info['error'] = str(e)
+        return None
+
+def chunk_ids(doc_info, num_chunks):
+    """IDs of a document's chunks, derived from its upload hash"""
+    prefix = doc_info['hash']
+    return [f"{prefix}_{idx}" for idx in range(num_chunks)]
+
+def mark_indexed(vector_store, doc_infos, chunk_counts, success):
+    """Record the outcome of an add_documents call on each document
+
+    On success, chunks stored for the same document name under other IDs
+    are removed. They come from an earlier upload of the file, or from
+    before uploads were hashed with BLAKE3, and would otherwise sit next
+    to the new copy as duplicates.
+    """
+    for doc_info, num_chunks in zip(doc_infos, chunk_counts):
         if success:
+            vector_store.remove_stale_chunks(doc_info['name'], chunk_ids(doc_info, num_chunks))
             doc_info['status'] = 'indexed'
-            doc_info['num_chunks'] = len(chunks)
-            return True
+            doc_info['num_chunks'] = num_chunks
         else:
             doc_info['status'] = 'failed_indexing'
             doc_info['error'] = 'Failed to add to vector store'
-            return False
-            
+
+def process_document(doc_info, doc_processor=None, vector_store=None):
+    """Process document and add to vector store
+
+    Like extract_and_chunk, processors can be passed in explicitly to run
+    this off the script thread.
+    """
+    vector_store = vector_store or st.session_state.vector_store.get()
+    extracted = extract_and_chunk(doc_info, doc_processor)
+    if extracted is None:
+        return False
+    
+    chunks, metadatas, ids = extracted
+    doc_info['status'] = 'indexing'
+    try:
+        # Add to vector store
+        success = vector_store.add_documents(
+            chunks=chunks,
+            metadatas=metadatas,
+            ids=ids
+        )
     except Exception as e:
         doc_info['status'] = 'error'
         doc_info['error'] = str(e)
         return False
+    
+    mark_indexed(vector_store, [doc_info], [len(chunks)], success)
+    return success
+
+def process_document_with_status(doc_info, status):
+    """Run process_document on a worker thread, reporting each stage in status
+
+    The script thread polls the worker rather than joining it outright, so
+    the st.status box moves from extraction to indexing as the worker does.
+    """
+    worker = threading.Thread(
+        target=process_document,
+        args=(
+            doc_info,
+            st.session_state.doc_processor.get(),
+            st.session_state.vector_store.get()
+        ),
+        daemon=True
+    )
+    worker.start()
+    
+    stage = None
+    while worker.is_alive():
+        if doc_info['status'] != stage:
+            stage = doc_info['status']
+            if stage in STAGE_LABELS:
+                status.update(label=f"{doc_info['name']}: {STAGE_LABELS[stage]}")
+                status.write(STAGE_LABELS[stage])
+        worker.join(timeout=STATUS_POLL_SECONDS)
+
+def index_documents(doc_infos, doc_processor, vector_store, on_progress=None):
+    """Extract and index several documents as a pipeline
+
+    A producer thread extracts documents with
+    DocumentProcessor.iter_process_files, which OCRs them concurrently
+    and parses large batches in worker processes, and hands each over
+    through a bounded queue as it finishes, while this thread embeds and
+    indexes the chunks in batches. Extraction of later documents overlaps with
+    indexing of earlier ones. A document is marked indexed only once the
+    batch holding its chunks has been written.
+    """
+    extracted_queue = queue.Queue(maxsize=EXTRACT_QUEUE_SIZE)
+    
+    def produce():
+        pending = set(range(len(doc_infos)))
+        for doc_info in doc_infos:
+            doc_info['status'] = 'processing'
+        try:
+            items = [(doc_info['path'], doc_info['type']) for doc_info in doc_infos]
+            for idx, result in doc_processor.iter_process_files(items):
+                pending.discard(idx)
+                doc_info = doc_infos[idx]
+                extracted_queue.put((doc_info, chunk_document(doc_info, result, doc_processor)))
+        except Exception as e:
+            # Whatever the pool didn't get to is reported, not left processing
+            for idx in sorted(pending):
+                doc_infos[idx]['status'] = 'error'
+                doc_infos[idx]['error'] = str(e)
+                extracted_queue.put((doc_infos[idx], None))
+        finally:
+            extracted_queue.put(None)
+    
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    
+    batch_chunks, batch_metadatas, batch_ids = [], [], []
+    batch_docs, batch_counts = [], []
+    
+    def flush():
+        if batch_chunks:
+            success = vector_store.add_documents(
+                chunks=batch_chunks,
+                metadatas=batch_metadatas,
+                ids=batch_ids
+            )
+            mark_indexed(vector_store, batch_docs, batch_counts, success)
+        for batch_list in (batch_chunks, batch_metadatas, batch_ids, batch_docs, batch_counts):
+            batch_list.clear()
+    
+    done = 0
+    while (item := extracted_queue.get()) is not None:
+        doc_info, extracted = item
+        if extracted is not None:
+            chunks, metadatas, ids = extracted
+            batch_chunks.extend(chunks)
+            batch_metadatas.extend(metadatas)
+            batch_ids.extend(ids)
+            batch_docs.append(doc_info)
+            batch_counts.append(len(chunks))
+        
+        # Flush when the batch is big enough or nothing else is ready yet
+        if len(batch_chunks) >= INDEX_BATCH_SIZE or extracted_queue.empty():
+            flush()
+        
+        done += 1
+        if on_progress:
+            on_progress(done / len(doc_infos))
+    
+    flush()
+    producer.join()
+
+# Collection stats, fetched once per rerun. Every action that changes the
+# collection ends in st.rerun(), so this is never stale when rendered.
+# Only asked for once the process-wide store exists (built by any
+# session), so the first paint doesn't open Chroma; until then the counts
+# show as "—".
+if get_vector_store.cache_info().currsize:
+    chunk_count = st.session_state.vector_store.get().get_collection_stats().get('total_chunks', 0)
+else:
+    chunk_count = "—"
 
 # Sidebar - File Upload
 with st.sidebar:
@@ -150,11 +376,13 @@ with st.sidebar:
     
     if uploaded_files:
         for uploaded_file in uploaded_files:
-            if uploaded_file.name not in [doc['name'] for doc in st.session_state.documents]:
+            if uploaded_file.name not in st.session_state.doc_names:
                 with st.spinner(f"Uploading {uploaded_file.name}..."):
                     doc_info, error = save_uploaded_file(uploaded_file)
                     if doc_info:
                         st.session_state.documents.append(doc_info)
+                        st.session_state.doc_hashes.add(doc_info['hash'])
+                        st.session_state.doc_names.add(doc_info['name'])
                         st.success(f"✅ {uploaded_file.name}")
                     elif error:
                         st.warning(f"⚠️ {error}")
@@ -165,14 +393,7 @@ with st.sidebar:
     
     if st.session_state.documents:
         for idx, doc in enumerate(st.session_state.documents):
-            status_emoji = {
-                'uploaded': '📤',
-                'processing': '⚙️',
-                'indexed': '✅',
-                'failed_parsing': '❌',
-                'failed_indexing': '❌',
-                'error': '⚠️'
-            }.get(doc['status'], '📄')
+            status_emoji = STATUS_EMOJI.get(doc['status'], '📄')
             
             with st.expander(f"{status_emoji} {doc['name']}", expanded=False):
                 st.write(f"**Status:** {doc['status']}")
@@ -187,19 +408,24 @@ with st.sidebar:
                 col1, col2 = st.columns(2)
                 with col1:
                     if st.button("🔄 Process", key=f"process_{idx}"):
-                        with st.spinner("Processing..."):
-                            success = process_document(doc)
-                            if success:
-                                st.success("Processed!")
+                        with st.status(f"Processing {doc['name']}...", expanded=True) as status:
+                            process_document_with_status(doc, status)
+                            if doc['status'] == 'indexed':
+                                status.update(label="Processed!", state="complete")
                                 st.rerun()
+                            else:
+                                error = doc.get('error', 'Unknown error')
+                                status.update(label=f"Failed: {error}", state="error")
                 with col2:
                     if st.button("🗑️ Delete", key=f"delete_{idx}"):
                         # Delete from vector store
-                        st.session_state.vector_store.delete_document(doc['name'])
+                        st.session_state.vector_store.get().delete_document(doc['name'])
                         # Delete file
                         if os.path.exists(doc['path']):
                             os.remove(doc['path'])
                         st.session_state.documents.pop(idx)
+                        st.session_state.doc_hashes.discard(doc['hash'])
+                        st.session_state.doc_names.discard(doc['name'])
                         st.rerun()
     else:
         st.info("No documents uploaded yet")
@@ -209,20 +435,30 @@ with st.sidebar:
     if st.session_state.documents:
         if st.button("⚡ Process All Documents", type="primary", use_container_width=True):
             progress_bar = st.progress(0)
-            for idx, doc in enumerate(st.session_state.documents):
-                if doc['status'] in ['uploaded', 'failed_parsing', 'failed_indexing']:
-                    with st.spinner(f"Processing {doc['name']}..."):
-                        process_document(doc)
-                progress_bar.progress((idx + 1) / len(st.session_state.documents))
+            pending = [
+                doc for doc in st.session_state.documents
+                if doc['status'] in ['uploaded', 'failed_parsing', 'failed_indexing']
+            ]
+            if pending:
+                with st.spinner(f"Processing {len(pending)} documents..."):
+                    index_documents(
+                        pending,
+                        st.session_state.doc_processor.get(),
+                        st.session_state.vector_store.get(),
+                        on_progress=progress_bar.progress
+                    )
             
             st.session_state.vector_store_ready = True
             st.success("All documents processed!")
             st.rerun()
     
     # Stats
-    stats = st.session_state.vector_store.get_collection_stats()
     st.divider()
-    st.metric("Total Chunks", stats.get('total_chunks', 0))
+    st.metric("Total Chunks", chunk_count)
+
+# Everything that changes document status has run by now (or triggered a
+# rerun), so compute the indexed set once for the rest of the page
+indexed_docs = [d for d in st.session_state.documents if d['status'] == 'indexed']
 
 # Main area - Header with stats
 col1, col2, col3 = st.columns([2, 1, 1])
@@ -230,11 +466,9 @@ with col1:
     st.title("🤖 Arabic RAG Assistant")
     st.caption("Ask questions, request tables & charts, search your documents")
 with col2:
-    indexed_count = len([d for d in st.session_state.documents if d['status'] == 'indexed'])
-    st.metric("📚 Documents", f"{indexed_count}/{len(st.session_state.documents)}")
+    st.metric("📚 Documents", f"{len(indexed_docs)}/{len(st.session_state.documents)}")
 with col3:
-    stats = st.session_state.vector_store.get_collection_stats()
-    st.metric("💾 Chunks", stats.get('total_chunks', 0))
+    st.metric("💾 Chunks", chunk_count)
 
 st.divider()
 
@@ -254,7 +488,6 @@ if prompt := st.chat_input("💬 Ask anything: questions, tables, charts, compar
         st.error("⚠️ Please upload documents first!")
     else:
         # Check if any documents are indexed
-        indexed_docs = [d for d in st.session_state.documents if d['status'] == 'indexed']
         if not indexed_docs:
             st.error("⚠️ Please process documents first!")
         else:
@@ -266,7 +499,7 @@ if prompt := st.chat_input("💬 Ask anything: questions, tables, charts, compar
             # Generate response
             with st.chat_message("assistant"):
                 with st.spinner("Thinking..."):
-                    result = st.session_state.rag_engine.query(prompt)
+                    result = st.session_state.rag_engine.get().query(prompt)
                     
                     response = result['answer']
                     sources = result.get('sources', [])
@@ -280,13 +513,14 @@ if prompt := st.chat_input("💬 Ask anything: questions, tables, charts, compar
                         
                         # Try to create visualization
                         context = "\n\n".join(result['documents'][:3])  # Use top 3 docs
-                        viz_data = st.session_state.visualizer.extract_structured_data(prompt, context)
+                        visualizer = st.session_state.visualizer.get()
+                        viz_data = visualizer.extract_structured_data(prompt, context)
                         
                         if viz_data:
                             st.write(f"✅ Found visualization data: {viz_data.get('type', 'unknown')}")
                             
                             if viz_data.get('type') == 'table':
-                                df = st.session_state.visualizer.create_table(
+                                df = visualizer.create_table(
                                     viz_data.get('data', []),
                                     viz_data.get('title', 'Data Table')
                                 )
@@ -300,14 +534,14 @@ if prompt := st.chat_input("💬 Ask anything: questions, tables, charts, compar
                                 st.write(f"Creating {viz_data.get('chart_type', 'bar')} chart...")
                                 st.write(f"Data points: {len(viz_data.get('data', []))}")
                                 
-                                chart_img = st.session_state.visualizer.create_chart(
+                                chart_fig = visualizer.render_chart_streamlit(
                                     viz_data.get('data', []),
                                     chart_type=viz_data.get('chart_type', 'bar'),
                                     title=viz_data.get('title', 'Chart')
                                 )
-                                if chart_img:
+                                if chart_fig:
                                     st.subheader(viz_data.get('title', 'Chart'))
-                                    st.image(f"data:image/png;base64,{chart_img}")
+                                    st.plotly_chart(chart_fig, use_container_width=True)
                                 else:
                                     st.error("Failed to generate chart. Check terminal for errors.")
                         else:
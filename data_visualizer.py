@@ -1,30 +1,105 @@
 """
 Data visualization module for generating tables and charts
+
+pandas, matplotlib, plotly and openai are imported on first use rather
+than at module import, so loading the app doesn't pay for them up front.
 """
-import pandas as pd
-import matplotlib.pyplot as plt
-import matplotlib
-matplotlib.use('Agg')  # Use non-interactive backend
 import io
+import re
+import threading
 import base64
-from typing import List, Dict, Optional
-import json
-from openai import OpenAI
+from collections import OrderedDict
+from typing import TYPE_CHECKING, List, Dict, Optional, Tuple
+import orjson
+import blake3
 import os
 from dotenv import load_dotenv
 
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+    import plotly.graph_objects as go
+
 load_dotenv()
 
+# Context sent for structured-data extraction is capped at roughly 2000
+# tokens; anything past that adds latency and cost without better tables
+MAX_CONTEXT_CHARS = 8000
+
+# Max (query, context) pairs whose extraction results are kept in memory
+EXTRACTION_CACHE_SIZE = 128
+
+# Cheap pre-filter for extract_structured_data: queries that mention none of
+# these over a context with no digits can't produce a table or chart
+VIZ_INTENT_RE = re.compile(
+    r'table|chart|graph|compare|comparison|bar|pie|line|plot|جدول|مخطط|مقارنة|قارن|رسم|بياني',
+    re.IGNORECASE
+)
+_DIGIT_RE = re.compile(r'\d')
+
+_mpl_ready = False
+
+def _ensure_mpl():
+    """Import matplotlib and select the non-interactive backend once"""
+    global _mpl_ready
+    if not _mpl_ready:
+        import matplotlib
+        matplotlib.use('Agg')  # Use non-interactive backend
+        _mpl_ready = True
+
+# create_chart output; lossy WEBP is several times smaller than PNG
+CHART_MIME_TYPE = 'image/webp'
+
+# Color palette
+CHART_COLORS = ['#4A90E2', '#50C878', '#FF6B6B', '#FFA500', '#9B59B6',
+                '#3498DB', '#E74C3C', '#2ECC71', '#F39C12', '#1ABC9C']
+
 class DataVisualizer:
     """Generate tables and charts from data"""
     
     def __init__(self):
+        from openai import OpenAI
         self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        
+        # Shared chart figure, created by _get_figure on first use
+        self._fig = None
+        self._ax = None
+        self._chart_lock = threading.Lock()
+        
+        # LRU cache of extraction results keyed on (query, context digest)
+        self._extraction_cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+    
+    def _get_figure(self):
+        """
+        Return the figure and axes reused for every chart
+        
+        Building a new figure per call costs more than drawing a handful of
+        bars. It is kept out of pyplot so sessions don't accumulate open
+        pyplot figures. Call with _chart_lock held.
+        """
+        if self._fig is None:
+            _ensure_mpl()
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+            from matplotlib.figure import Figure
+            
+            self._fig = Figure(figsize=(12, 7))
+            FigureCanvasAgg(self._fig)
+            self._ax = self._fig.subplots()
+            self._fig.patch.set_facecolor('white')
+        return self._fig, self._ax
     
     def extract_structured_data(self, query: str, context: str) -> Optional[Dict]:
         """
         Use GPT to extract structured data from context
         
+        The API call is skipped when the query shows no visualization intent
+        and the context has no numbers. Otherwise the context is truncated
+        to MAX_CONTEXT_CHARS before it is sent.
+        Results are cached per (query, context) so repeated visualization
+        requests over the same retrieved chunks skip the API call. The key
+        uses a digest of the context, so it changes whenever the documents do.
+        
         Args:
             query: User's request
             context: Retrieved document content
@@ -32,16 +107,39 @@ class DataVisualizer:
         Returns:
             Dict with structured data or None
         """
+        if not context or not (VIZ_INTENT_RE.search(query) or _DIGIT_RE.search(context)):
+            return None
+        
+        context = context[:MAX_CONTEXT_CHARS]
+        key = (query, blake3.blake3(context.encode('utf-8')).hexdigest())
+        with self._cache_lock:
+            if key in self._extraction_cache:
+                self._extraction_cache.move_to_end(key)
+                return self._extraction_cache[key]
+        
         try:
-            prompt = f"""Based on this query: "{query}"
+            result = self._request_structured_data(query, context)
+        except Exception as e:
+            print(f"Error extracting structured data: {e}")
+            return None
+        
+        with self._cache_lock:
+            self._extraction_cache[key] = result
+            if len(self._extraction_cache) > EXTRACTION_CACHE_SIZE:
+                self._extraction_cache.popitem(last=False)
+        
+        return result
+    
+    def _request_structured_data(self, query: str, context: str) -> Optional[Dict]:
+        """Ask GPT for structured data; raises on API or parse errors"""
+        prompt = f"""Based on this query: "{query}"
 
 Extract structured data from the following context and return it as JSON.
 
 Context:
 {context}
 
-If the query asks for a comparison, table, or chart, extract the relevant data.
-Return ONLY valid JSON in this format:
+If the query asks for a comparison, table, or chart, extract the relevant data in this format:
 {{
     "type": "table" or "chart",
     "title": "descriptive title",
@@ -54,37 +152,28 @@ Return ONLY valid JSON in this format:
 
 If no structured data can be extracted, return: {{"type": "none"}}
 """
-            
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": "You extract structured data and return valid JSON only. No explanations."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.1,
-                max_tokens=1000
-            )
-            
-            result_text = response.choices[0].message.content.strip()
-            
-            # Clean up response (remove markdown code blocks if present)
-            if result_text.startswith("```"):
-                result_text = result_text.split("```")[1]
-                if result_text.startswith("json"):
-                    result_text = result_text[4:]
-            
-            result = json.loads(result_text)
-            
-            if result.get("type") == "none":
-                return None
-            
-            return result
-            
-        except Exception as e:
-            print(f"Error extracting structured data: {e}")
+        
+        response = self.client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[
+                {"role": "system", "content": "You extract structured data as a JSON object."},
+                {"role": "user", "content": prompt}
+            ],
+            response_format={"type": "json_object"},
+            temperature=0.1,
+            max_tokens=400
+        )
+        
+        # JSON mode guarantees a bare JSON object, no markdown fences
+        result_text = response.choices[0].message.content
+        result = orjson.loads(result_text)
+        
+        if result.get("type") == "none":
             return None
+        
+        return result
     
-    def create_table(self, data: List[Dict], title: str = "Data Table") -> pd.DataFrame:
+    def create_table(self, data: List[Dict], title: str = "Data Table") -> "pd.DataFrame":
         """
         Create a pandas DataFrame from structured data
         
@@ -95,6 +184,8 @@ If no structured data can be extracted, return: {{"type": "none"}}
         Returns:
             pandas DataFrame
         """
+        import pandas as pd
+        
         try:
             df = pd.DataFrame(data)
             return df
@@ -102,6 +193,102 @@ If no structured data can be extracted, return: {{"type": "none"}}
             print(f"Error creating table: {e}")
             return pd.DataFrame()
     
+    def _extract_series(self, data: List[Dict]) -> Tuple["np.ndarray", "np.ndarray"]:
+        """
+        Pull chart labels and numeric values out of structured data
+        
+        Args:
+            data: List of dicts with 'label'/'name' and 'value'/'count'
+            
+        Returns:
+            Tuple of (labels, values) arrays; items with non-numeric values are skipped
+        """
+        import numpy as np
+        import pandas as pd
+        
+        labels = np.array([str(item.get('label', item.get('name', f'Item {i+1}')))
+                           for i, item in enumerate(data)])
+        raw_values = [item.get('value', item.get('count', 0)) for item in data]
+        
+        # Coerce in one pass; anything non-numeric becomes NaN and is dropped
+        values = pd.to_numeric(
+            [v if isinstance(v, (int, float, str)) else None for v in raw_values],
+            errors='coerce'
+        ).astype(float)
+        mask = ~np.isnan(values)
+        
+        if not mask.all():
+            for label, value, valid in zip(labels, raw_values, mask):
+                if not valid:
+                    print(f"Invalid value for {label}: {value}")
+        
+        return labels[mask], values[mask]
+    
+    def render_chart_streamlit(self,
+                               data: List[Dict],
+                               chart_type: str = "bar",
+                               title: str = "Chart",
+                               xlabel: str = "",
+                               ylabel: str = "Value") -> Optional["go.Figure"]:
+        """
+        Create an interactive Plotly chart for st.plotly_chart
+        
+        Plotly figures are sent to the browser as a JSON trace spec and
+        rendered client-side, so there is no server-side rasterization or
+        base64 encoding. Use create_chart when a static WEBP image is needed.
+        
+        Args:
+            data: List of dicts with 'label' and 'value'
+            chart_type: 'bar', 'line', or 'pie'
+            title: Chart title
+            xlabel: X-axis label
+            ylabel: Y-axis label
+            
+        Returns:
+            plotly Figure, or None if there is nothing to plot
+        """
+        try:
+            import plotly.graph_objects as go
+            
+            if not data:
+                print("No data provided for chart")
+                return None
+            
+            labels, values = self._extract_series(data)
+            
+            if len(values) == 0:
+                print("No valid data extracted for chart")
+                return None
+            
+            if chart_type == "pie":
+                trace = go.Pie(labels=labels, values=values,
+                               marker={'colors': CHART_COLORS[:len(labels)],
+                                       'line': {'color': 'white', 'width': 2}})
+            elif chart_type == "line":
+                trace = go.Scatter(x=labels, y=values, mode='lines+markers+text',
+                                   text=[f'{v:.1f}' for v in values], textposition='top center',
+                                   line={'color': CHART_COLORS[0], 'width': 3},
+                                   marker={'color': CHART_COLORS[1], 'size': 10,
+                                           'line': {'color': 'white', 'width': 2}})
+            else:
+                trace = go.Bar(x=labels, y=values,
+                               text=[f'{v:.1f}' for v in values], textposition='outside',
+                               marker={'color': CHART_COLORS[:len(labels)],
+                                       'line': {'color': 'white', 'width': 1.5}},
+                               opacity=0.8)
+            
+            fig = go.Figure(trace)
+            fig.update_layout(title=title, template='plotly_white')
+            if chart_type != "pie":
+                fig.update_xaxes(title=xlabel if xlabel else "Categories", tickangle=-45)
+                fig.update_yaxes(title=ylabel if ylabel else "Values")
+            
+            return fig
+            
+        except Exception as e:
+            print(f"Error creating chart: {e}")
+            return None
+    
     def create_chart(self, 
                      data: List[Dict], 
                      chart_type: str = "bar",
@@ -119,7 +306,7 @@ If no structured data can be extracted, return: {{"type": "none"}}
             ylabel: Y-axis label
             
         Returns:
-            Base64 encoded PNG image string
+            Base64 encoded WEBP image string (see CHART_MIME_TYPE)
         """
         try:
             # Validate data
@@ -127,92 +314,83 @@ If no structured data can be extracted, return: {{"type": "none"}}
                 print("No data provided for chart")
                 return None
             
-            # Extract labels and values with better error handling
-            labels = []
-            values = []
+            labels, values = self._extract_series(data)
             
-            for i, item in enumerate(data):
-                label = item.get('label', item.get('name', f'Item {i+1}'))
-                value = item.get('value', item.get('count', 0))
-                
-                # Try to convert value to float
-                try:
-                    value = float(value)
-                except (ValueError, TypeError):
-                    print(f"Invalid value for {label}: {value}")
-                    continue
-                
-                labels.append(str(label))
-                values.append(value)
-            
-            if not labels or not values:
+            if len(values) == 0:
                 print("No valid data extracted for chart")
                 return None
             
-            # Create figure with better styling
-            fig, ax = plt.subplots(figsize=(12, 7))
-            fig.patch.set_facecolor('white')
-            
-            # Color palette
-            colors = ['#4A90E2', '#50C878', '#FF6B6B', '#FFA500', '#9B59B6', 
-                     '#3498DB', '#E74C3C', '#2ECC71', '#F39C12', '#1ABC9C']
-            
-            if chart_type == "bar":
-                bars = ax.bar(labels, values, color=colors[:len(labels)], 
-                             edgecolor='white', linewidth=1.5, alpha=0.8)
-                ax.set_xlabel(xlabel if xlabel else "Categories", fontsize=11, fontweight='bold')
-                ax.set_ylabel(ylabel if ylabel else "Values", fontsize=11, fontweight='bold')
-                plt.xticks(rotation=45, ha='right')
+            with self._chart_lock:
+                # Reset the shared figure
+                fig, ax = self._get_figure()
+                ax.clear()
+                ax.set_axis_on()
+                ax.set_frame_on(True)
+                ax.set_aspect('auto')
+                for spine in ax.spines.values():
+                    spine.set_visible(True)
                 
-                # Add value labels on bars
-                for bar in bars:
-                    height = bar.get_height()
-                    ax.text(bar.get_x() + bar.get_width()/2., height,
-                           f'{height:.1f}',
-                           ha='center', va='bottom', fontsize=9)
+                colors = CHART_COLORS
                 
-            elif chart_type == "line":
-                ax.plot(labels, values, marker='o', linewidth=3, markersize=10,
-                       color=colors[0], markerfacecolor=colors[1], 
-                       markeredgecolor='white', markeredgewidth=2)
-                ax.set_xlabel(xlabel if xlabel else "Categories", fontsize=11, fontweight='bold')
-                ax.set_ylabel(ylabel if ylabel else "Values", fontsize=11, fontweight='bold')
-                plt.xticks(rotation=45, ha='right')
-                ax.grid(True, alpha=0.3, linestyle='--')
+                if chart_type == "bar":
+                    bars = ax.bar(labels, values, color=colors[:len(labels)], 
+                                 edgecolor='white', linewidth=1.5, alpha=0.8)
+                    ax.set_xlabel(xlabel if xlabel else "Categories", fontsize=11, fontweight='bold')
+                    ax.set_ylabel(ylabel if ylabel else "Values", fontsize=11, fontweight='bold')
+                    for tick_label in ax.get_xticklabels():
+                        tick_label.set_rotation(45)
+                        tick_label.set_ha('right')
                 
-                # Add value labels
-                for i, (x, y) in enumerate(zip(labels, values)):
-                    ax.text(i, y, f'{y:.1f}', ha='center', va='bottom', fontsize=9)
+                    # Add value labels on bars
+                    for bar in bars:
+                        height = bar.get_height()
+                        ax.text(bar.get_x() + bar.get_width()/2., height,
+                               f'{height:.1f}',
+                               ha='center', va='bottom', fontsize=9)
                 
-            elif chart_type == "pie":
-                wedges, texts, autotexts = ax.pie(values, labels=labels, autopct='%1.1f%%', 
-                                                   startangle=90, colors=colors[:len(labels)],
-                                                   wedgeprops={'edgecolor': 'white', 'linewidth': 2})
-                ax.axis('equal')
+                elif chart_type == "line":
+                    ax.plot(labels, values, marker='o', linewidth=3, markersize=10,
+                           color=colors[0], markerfacecolor=colors[1], 
+                           markeredgecolor='white', markeredgewidth=2)
+                    ax.set_xlabel(xlabel if xlabel else "Categories", fontsize=11, fontweight='bold')
+                    ax.set_ylabel(ylabel if ylabel else "Values", fontsize=11, fontweight='bold')
+                    for tick_label in ax.get_xticklabels():
+                        tick_label.set_rotation(45)
+                        tick_label.set_ha('right')
+                    ax.grid(True, alpha=0.3, linestyle='--')
                 
-                # Make percentage text bold
-                for autotext in autotexts:
-                    autotext.set_color('white')
-                    autotext.set_fontweight('bold')
-            
-            ax.set_title(title, fontsize=16, fontweight='bold', pad=20)
-            
-            # Remove top and right spines for bar/line charts
-            if chart_type in ["bar", "line"]:
-                ax.spines['top'].set_visible(False)
-                ax.spines['right'].set_visible(False)
-            
-            plt.tight_layout()
-            
-            # Convert to base64
-            buffer = io.BytesIO()
-            plt.savefig(buffer, format='png', dpi=150, bbox_inches='tight', 
-                       facecolor='white', edgecolor='none')
-            buffer.seek(0)
-            img_base64 = base64.b64encode(buffer.read()).decode()
-            plt.close(fig)
-            
-            return img_base64
+                    # Add value labels
+                    for i, (x, y) in enumerate(zip(labels, values)):
+                        ax.text(i, y, f'{y:.1f}', ha='center', va='bottom', fontsize=9)
+                
+                elif chart_type == "pie":
+                    wedges, texts, autotexts = ax.pie(values, labels=labels, autopct='%1.1f%%', 
+                                                       startangle=90, colors=colors[:len(labels)],
+                                                       wedgeprops={'edgecolor': 'white', 'linewidth': 2})
+                    ax.axis('equal')
+                
+                    # Make percentage text bold
+                    for autotext in autotexts:
+                        autotext.set_color('white')
+                        autotext.set_fontweight('bold')
+                
+                ax.set_title(title, fontsize=16, fontweight='bold', pad=20)
+                
+                # Remove top and right spines for bar/line charts
+                if chart_type in ["bar", "line"]:
+                    ax.spines['top'].set_visible(False)
+                    ax.spines['right'].set_visible(False)
+                
+                # tight_layout frames the chart up front, so the image is drawn
+                # in a single pass instead of the extra bbox_inches='tight' one
+                fig.tight_layout(pad=0.3)
+                
+                # Convert to base64
+                buffer = io.BytesIO()
+                fig.savefig(buffer, format='webp', dpi=100, pil_kwargs={'quality': 85})
+                img_base64 = base64.b64encode(buffer.getvalue()).decode()
+                
+                return img_base64
             
         except Exception as e:
             print(f"Error creating chart: {e}")
@@ -223,7 +401,7 @@ If no structured data can be extracted, return: {{"type": "none"}}
     def generate_comparison_table(self, 
                                  query: str,
                                  documents: List[str],
-                                 metadatas: List[Dict]) -> Optional[pd.DataFrame]:
+                                 metadatas: List[Dict]) -> Optional["pd.DataFrame"]:
         """
         Generate a comparison table from multiple documents
         
@@ -278,4 +456,4 @@ if __name__ == "__main__":
     # Test chart
     chart_img = visualizer.create_chart(test_data, chart_type="bar", title="Test Chart")
     if chart_img:
-        print(f"Chart created (base64 length: {len(chart_img)})")
\ No newline at end of file
+        print(f"Chart created ({CHART_MIME_TYPE}, base64 length: {len(chart_img)})")
\ No newline at end of file
@@ -2,13 +2,148 @@
 Document processor for extracting text from various file formats
 """
 import os
+import re
+import multiprocessing
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import Dict, List, Tuple
-import PyPDF2
+from typing import Dict, Iterator, List, Tuple
+import fitz  # PyMuPDF
 from docx import Document
 import openpyxl
 from PIL import Image
 import io
+import numpy as np
+
+try:
+    import numba
+except ImportError:  # optional; chunk_text falls back to pure Python
+    numba = None
+
+# PDFs averaging fewer extracted characters per page than this are treated
+# as scanned and sent to OCR
+SCANNED_PDF_MIN_CHARS = 30
+
+def _avg_chars_per_page(pages: List[Dict]) -> float:
+    """Average stripped text length of extracted PDF pages"""
+    if not pages:
+        return 0
+    return sum(len(page['text'].strip()) for page in pages) / len(pages)
+
+def _process_file_without_ocr(file_path: str, file_type: str) -> Dict:
+    """Pool worker: parse one file with an OCR-less DocumentProcessor"""
+    return DocumentProcessor().process_file(file_path, file_type)
+
+def _process_indexed_file(item: Tuple[int, Tuple[str, str]]) -> Tuple[int, Dict]:
+    """Pool worker for imap_unordered: keeps the item's position with its result"""
+    pos, (file_path, file_type) = item
+    return pos, _process_file_without_ocr(file_path, file_type)
+
+# Rows of raw cell data kept per sheet in process_xlsx results
+MAX_SHEET_DATA_ROWS = 1000
+
+# Sentence endings chunk_text breaks after; each window ends at the last one
+# it contains. A run of blank lines counts as one boundary.
+CHUNK_BOUNDARIES = ['. ', '。', '！', '؟', '\n\n']
+CHUNK_BOUNDARY_RE = re.compile(r'\. |。|！|؟|\n\n+')
+
+# Texts at least this long are chunked by the compiled boundary scan when
+# numba is installed; below it the JIT warm-up isn't worth it
+NUMBA_MIN_CHARS = 100_000
+
+def _boundary_codepoints() -> Tuple[np.ndarray, np.ndarray]:
+    """CHUNK_BOUNDARIES as a padded codepoint matrix plus their lengths"""
+    width = max(len(punct) for punct in CHUNK_BOUNDARIES)
+    codes = np.zeros((len(CHUNK_BOUNDARIES), width), dtype=np.uint32)
+    lengths = np.empty(len(CHUNK_BOUNDARIES), dtype=np.int64)
+    for row, punct in enumerate(CHUNK_BOUNDARIES):
+        codes[row, :len(punct)] = [ord(c) for c in punct]
+        lengths[row] = len(punct)
+    return codes, lengths
+
+def _chunk_bounds_py(codes, chunk_size, overlap, punct_codes, punct_lengths):
+    """Compute (start, end) offsets of each chunk over a codepoint array
+
+    Same result as the CHUNK_BOUNDARY_RE path in chunk_text: each window
+    breaks at the furthest point where one of the boundaries ends.
+    Compiled with numba when available.
+    """
+    text_length = len(codes)
+    bounds = np.empty((16, 2), dtype=np.int64)
+    count = 0
+    start = 0
+    
+    while start < text_length:
+        end = start + chunk_size
+        
+        # Try to break at sentence boundary
+        if end < text_length:
+            # Reverse scan for the last boundary ending inside (start, end]
+            found = -1
+            for e in range(end, start, -1):
+                for p in range(len(punct_lengths)):
+                    plen = punct_lengths[p]
+                    if e - plen < start:
+                        continue
+                    matched = True
+                    for j in range(plen):
+                        if codes[e - plen + j] != punct_codes[p, j]:
+                            matched = False
+                            break
+                    if matched:
+                        found = e
+                        break
+                if found != -1:
+                    break
+            if found != -1:
+                end = found
+        
+        if count == len(bounds):
+            grown = np.empty((len(bounds) * 2, 2), dtype=np.int64)
+            grown[:count] = bounds[:count]
+            bounds = grown
+        bounds[count, 0] = start
+        bounds[count, 1] = end
+        count += 1
+        
+        # Always move forward, even when a boundary came before the overlap
+        next_start = end - overlap
+        start = next_start if next_start > start else end
+    
+    return bounds[:count]
+
+_chunk_bounds_jit = numba.njit(cache=True)(_chunk_bounds_py) if numba else None
+
+# Starting a spawn pool costs each worker a fresh interpreter that
+# re-imports fitz, docx and openpyxl; below this many bytes to parse,
+# process_files parses in this process instead
+PROCESS_POOL_MIN_BYTES = 16 * 1024 * 1024
+
+# Images and scanned PDFs OCRed at once by process_files; each spends
+# nearly all its time waiting on the Vision API
+OCR_WORKERS = 8
+
+def _total_size(items: List[Tuple[str, str]]) -> int:
+    """Combined size in bytes of the files in items; missing files count as 0"""
+    total = 0
+    for file_path, _ in items:
+        try:
+            total += os.path.getsize(file_path)
+        except OSError:
+            pass
+    return total
+
+def _finished(futures: Dict[Future, int], block: bool) -> Iterator[Tuple[int, Dict]]:
+    """Pop and yield (index, result) for finished futures, or all of them if block"""
+    done = list(as_completed(futures)) if block else [f for f in futures if f.done()]
+    for future in done:
+        yield futures.pop(future), future.result()
+
+def _ingest_workers() -> int:
+    """Worker count for process_files; INGEST_WORKERS overrides the default"""
+    workers = os.environ.get("INGEST_WORKERS")
+    if workers:
+        return max(1, int(workers))
+    return max(1, (os.cpu_count() or 2) - 1)
 
 class DocumentProcessor:
     """Process different document types and extract text"""
@@ -55,37 +190,118 @@ class DocumentProcessor:
                 'error': str(e)
             }
     
+    def process_files(self, items: List[Tuple[str, str]]) -> List[Dict]:
+        """
+        Process several files, parsing and OCRing them concurrently
+        
+        Args:
+            items: List of (file_path, file_type) tuples
+            
+        Returns:
+            List of results in the same order as items, as from process_file
+        """
+        results = [None] * len(items)
+        for idx, result in self.iter_process_files(items):
+            results[idx] = result
+        return results
+    
+    def iter_process_files(self, items: List[Tuple[str, str]]) -> Iterator[Tuple[int, Dict]]:
+        """
+        Process several files, yielding each result as soon as it is ready
+        
+        Anything that needs OCR (images, and PDFs that turn out to be
+        scanned) runs on a thread pool in this process, which owns the OCR
+        processor and its OpenAI client, up to OCR_WORKERS at once. PDF,
+        Word and Excel parsing is CPU-bound, so it is spread over a process
+        pool when there is enough of it to pay for starting one.
+        
+        Args:
+            items: List of (file_path, file_type) tuples
+            
+        Yields:
+            (index into items, result as from process_file), in completion order
+        """
+        ocr_indices = []
+        parse_indices = []
+        
+        for idx, (file_path, file_type) in enumerate(items):
+            if file_type.startswith('image/') and self.ocr_processor:
+                ocr_indices.append(idx)
+            else:
+                parse_indices.append(idx)
+        
+        with ThreadPoolExecutor(max_workers=OCR_WORKERS) as executor:
+            ocr_futures = {
+                executor.submit(self.process_file, *items[idx]): idx
+                for idx in ocr_indices
+            }
+            
+            for idx, result in self._parse_files(items, parse_indices):
+                if self._is_scanned(result):
+                    # Scanned PDF: redo it here so the OCR fallback can run
+                    ocr_futures[executor.submit(self.process_file, *items[idx])] = idx
+                else:
+                    yield idx, result
+                yield from _finished(ocr_futures, block=False)
+            
+            yield from _finished(ocr_futures, block=True)
+    
+    def _parse_files(self,
+                     items: List[Tuple[str, str]],
+                     indices: List[int]) -> Iterator[Tuple[int, Dict]]:
+        """Parse the given items without OCR, in worker processes if worth it"""
+        parse_items = [items[idx] for idx in indices]
+        workers = min(_ingest_workers(), len(parse_items))
+        
+        if workers > 1 and _total_size(parse_items) >= PROCESS_POOL_MIN_BYTES:
+            # spawn rather than fork: the app runs threads, and forking a
+            # threaded process can deadlock the child
+            with multiprocessing.get_context("spawn").Pool(workers) as pool:
+                parsed = pool.imap_unordered(_process_indexed_file, enumerate(parse_items))
+                for pos, result in parsed:
+                    yield indices[pos], result
+        else:
+            for idx, item in zip(indices, parse_items):
+                yield idx, _process_file_without_ocr(*item)
+    
+    def _is_scanned(self, result: Dict) -> bool:
+        """Whether a PDF parsed without OCR needs redoing with it"""
+        return bool(self.ocr_processor
+                    and result['status'] == 'success'
+                    and result['metadata'].get('type') == 'pdf'
+                    and _avg_chars_per_page(result['pages']) < SCANNED_PDF_MIN_CHARS)
+    
     def process_pdf(self, file_path: str) -> Dict:
         """Extract text from PDF - with OCR fallback for scanned PDFs"""
         pages = []
-        full_text = []
+        full_text = io.StringIO()
         
         try:
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                num_pages = len(pdf_reader.pages)
+            with fitz.open(file_path) as pdf_doc:
+                num_pages = len(pdf_doc)
                 
                 # Try extracting text first
-                total_text_length = 0
-                for page_num in range(num_pages):
-                    page = pdf_reader.pages[page_num]
-                    text = page.extract_text()
-                    total_text_length += len(text.strip())
+                for page_num, page in enumerate(pdf_doc):
+                    text = page.get_text("text")
                     
                     pages.append({
                         'page_number': page_num + 1,
                         'text': text,
                         'char_count': len(text)
                     })
-                    full_text.append(text)
+                    if page_num:
+                        full_text.write('\n\n')
+                    full_text.write(text)
                 
                 # If very little text extracted, likely scanned PDF
-                avg_chars_per_page = total_text_length / num_pages if num_pages > 0 else 0
+                avg_chars_per_page = _avg_chars_per_page(pages)
                 
-                if avg_chars_per_page < 30 and self.ocr_processor:
+                if avg_chars_per_page < SCANNED_PDF_MIN_CHARS and self.ocr_processor:
                     # Use OCR for scanned PDF
                     print(f"Detected scanned PDF (avg {avg_chars_per_page:.0f} chars/page), using OCR...")
-                    ocr_result = self.ocr_processor.process_scanned_pdf(file_path, max_pages=min(num_pages, 20))
+                    ocr_result = self.ocr_processor.process_scanned_pdf(
+                        file_path, max_pages=min(num_pages, 20), doc=pdf_doc
+                    )
                     
                     if ocr_result['status'] == 'success':
                         return {
@@ -103,7 +319,7 @@ class DocumentProcessor:
             print(f"Error in PDF processing: {e}")
         
         return {
-            'text': '\n\n'.join(full_text),
+            'text': full_text.getvalue(),
             'pages': pages,
             'metadata': {
                 'num_pages': len(pages),
@@ -117,15 +333,17 @@ class DocumentProcessor:
         doc = Document(file_path)
         
         paragraphs = []
-        full_text = []
+        full_text = io.StringIO()
         
         for para in doc.paragraphs:
             if para.text.strip():
+                if paragraphs:
+                    full_text.write('\n\n')
                 paragraphs.append({
                     'text': para.text,
                     'style': para.style.name
                 })
-                full_text.append(para.text)
+                full_text.write(para.text)
         
         # Extract tables
         tables = []
@@ -137,7 +355,7 @@ class DocumentProcessor:
             tables.append(table_data)
         
         return {
-            'text': '\n\n'.join(full_text),
+            'text': full_text.getvalue(),
             'pages': paragraphs,
             'metadata': {
                 'num_paragraphs': len(paragraphs),
@@ -149,34 +367,48 @@ class DocumentProcessor:
     
     def process_xlsx(self, file_path: str) -> Dict:
         """Extract text from Excel file"""
-        workbook = openpyxl.load_workbook(file_path, data_only=True)
+        # Read-only mode streams rows instead of loading every cell up front
+        workbook = openpyxl.load_workbook(file_path, data_only=True, read_only=True)
         
         sheets_data = []
-        full_text = []
+        full_text = io.StringIO()
         
-        for sheet_name in workbook.sheetnames:
-            sheet = workbook[sheet_name]
-            
-            # Get all values
-            sheet_text = []
-            sheet_data = []
-            
-            for row in sheet.iter_rows(values_only=True):
-                row_data = [str(cell) if cell is not None else '' for cell in row]
-                sheet_data.append(row_data)
-                row_text = ' | '.join([cell for cell in row_data if cell])
-                if row_text:
-                    sheet_text.append(row_text)
-            
-            sheets_data.append({
-                'sheet_name': sheet_name,
-                'text': '\n'.join(sheet_text),
-                'data': sheet_data
-            })
-            full_text.extend(sheet_text)
+        try:
+            for sheet_name in workbook.sheetnames:
+                sheet = workbook[sheet_name]
+                # Read-only sheets trust the stored <dimension>, which some
+                # writers leave at A1; without a reset the rows get truncated
+                sheet.reset_dimensions()
+                
+                # Get all values
+                sheet_text = io.StringIO()
+                sheet_data = []
+                
+                for row in sheet.iter_rows(values_only=True):
+                    row_data = ['' if cell is None else str(cell) for cell in row]
+                    # Keep only a preview of the raw grid; the text has every row
+                    if len(sheet_data) < MAX_SHEET_DATA_ROWS:
+                        sheet_data.append(row_data)
+                    row_text = ' | '.join(filter(None, row_data))
+                    if row_text:
+                        if sheet_text.tell():
+                            sheet_text.write('\n')
+                        sheet_text.write(row_text)
+                        if full_text.tell():
+                            full_text.write('\n\n')
+                        full_text.write(row_text)
+                
+                sheets_data.append({
+                    'sheet_name': sheet_name,
+                    'text': sheet_text.getvalue(),
+                    'data': sheet_data
+                })
+        finally:
+            # Read-only workbooks hold the file open until closed
+            workbook.close()
         
         return {
-            'text': '\n\n'.join(full_text),
+            'text': full_text.getvalue(),
             'pages': sheets_data,
             'metadata': {
                 'num_sheets': len(sheets_data),
@@ -251,10 +483,39 @@ class DocumentProcessor:
         Returns:
             List of text chunks
         """
+        return list(self.iter_chunks(text, chunk_size, overlap))
+    
+    def iter_chunks(self, text: str, chunk_size: int = 1000, overlap: int = 200) -> Iterator[str]:
+        """
+        Yield the chunks of chunk_text one at a time
+        
+        Lets callers embed and discard chunks as they go instead of holding
+        every chunk of a large document at once.
+        
+        Args:
+            text: Input text
+            chunk_size: Size of each chunk in characters
+            overlap: Overlap between chunks
+        
+        Yields:
+            Text chunks
+        """
         if not text:
-            return []
+            return
+        
+        # Large texts go through the compiled scan over a codepoint array;
+        # offsets are codepoint indices, so they slice the str directly
+        if _chunk_bounds_jit is not None and len(text) >= NUMBA_MIN_CHARS:
+            codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+            punct_codes, punct_lengths = _boundary_codepoints()
+            bounds = _chunk_bounds_jit(codes, chunk_size, overlap, punct_codes, punct_lengths)
+            del codes  # the UTF-32 copy is 4x the text; drop it before yielding
+            for start, end in bounds:
+                chunk = text[start:end].strip()
+                if chunk:
+                    yield chunk
+            return
         
-        chunks = []
         start = 0
         text_length = len(text)
         
@@ -263,20 +524,20 @@ class DocumentProcessor:
             
             # Try to break at sentence boundary
             if end < text_length:
-                # Look for sentence endings
-                for punct in ['. ', '。', '！', '؟', '\n\n']:
-                    last_punct = text[start:end].rfind(punct)
-                    if last_punct != -1:
-                        end = start + last_punct + len(punct)
-                        break
+                # One pass over the window for the last sentence ending
+                last_match = None
+                for last_match in CHUNK_BOUNDARY_RE.finditer(text, start, end):
+                    pass
+                if last_match is not None:
+                    end = last_match.end()
             
             chunk = text[start:end].strip()
             if chunk:
-                chunks.append(chunk)
+                yield chunk
             
-            start = end - overlap
-        
-        return chunks
+            # Always move forward, even when a boundary came before the overlap
+            next_start = end - overlap
+            start = next_start if next_start > start else end
 
 
 # Test function
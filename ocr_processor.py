@@ -2,54 +2,160 @@
 OCR Processor using GPT-4 Vision for scanned documents
 """
 import os
+import asyncio
 import base64
+import functools
 from pathlib import Path
 from typing import Dict, List, Optional
-from openai import OpenAI
-from PIL import Image
+from openai import AsyncOpenAI, OpenAI
+from PIL import Image, ImageOps
 
 import io
 from dotenv import load_dotenv
+from openai_http import async_http_client, run_coroutine, sync_http_client
+
+try:
+    import cv2
+    import numpy as np
+except ImportError:  # optional; pages are JPEG-encoded by PyMuPDF instead
+    cv2 = None
 
 load_dotenv()
 
+# Max GPT-4 Vision requests in flight while OCRing a scanned PDF
+OCR_CONCURRENCY = 8
+
+# JPEG quality for images sent to the Vision API; much smaller than PNG,
+# still legible
+JPEG_QUALITY = 85
+
+# The Vision API downscales larger images itself, so anything beyond this
+# is wasted upload
+MAX_IMAGE_SIDE = 2048
+
+# A first page with less text than this is treated as scanned
+SCANNED_TEXT_MIN_CHARS = 500
+
+def _prepare_image(image_path: str) -> bytes:
+    """
+    Downscale an image to MAX_IMAGE_SIDE and re-encode it as JPEG
+    
+    Args:
+        image_path: Path to image file
+        
+    Returns:
+        JPEG encoded bytes
+    """
+    with Image.open(image_path) as img:
+        # Re-encoding drops the EXIF orientation, so apply it first; phone
+        # photos would otherwise arrive sideways
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((MAX_IMAGE_SIDE, MAX_IMAGE_SIDE), Image.LANCZOS)
+        buffer = io.BytesIO()
+        _flatten(img).save(buffer, "JPEG", quality=JPEG_QUALITY, optimize=True)
+        return buffer.getvalue()
+
+def _flatten(img: Image.Image) -> Image.Image:
+    """
+    Convert an image to RGB, compositing any transparency onto white
+    
+    A plain convert("RGB") turns transparent pixels black, which hides
+    dark text on a transparent background.
+    """
+    if img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info):
+        rgba = img.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        return background
+    return img.convert("RGB")
+
+# Prefix of the data: URLs images are sent to the Vision API as
+DATA_URL_PREFIX = b"data:image/jpeg;base64,"
+
+def _data_url(data: bytes) -> str:
+    """
+    Build a JPEG data: URL, concatenating as bytes and decoding once
+    
+    Args:
+        data: JPEG encoded bytes
+        
+    Returns:
+        data:image/jpeg;base64,... string
+    """
+    return (DATA_URL_PREFIX + base64.b64encode(memoryview(data))).decode('ascii')
+
+@functools.lru_cache(maxsize=64)
+def _file_data_url(image_path: str, mtime_ns: int, size: int) -> str:
+    """Prepare a file and build its data: URL; mtime_ns and size only key the cache"""
+    return _data_url(_prepare_image(image_path))
+
 class OCRProcessor:
     """Process images and scanned documents using GPT-4 Vision"""
     
     def __init__(self):
-        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self._http_client = sync_http_client()
+        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=self._http_client)
         self.model = "gpt-4o"  # GPT-4 with vision
     
     def encode_image(self, image_path: str) -> str:
         """
-        Encode image to base64
+        Encode image to base64, downscaled to JPEG for the Vision API
         
         Args:
             image_path: Path to image file
             
         Returns:
-            Base64 encoded string
+            Base64 encoded JPEG string
         """
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+        return self._image_url(image_path)[len(DATA_URL_PREFIX):]
+    
+    def _image_url(self, image_path: str) -> str:
+        """Data: URL of a downscaled JPEG of image_path, cached per file version"""
+        # Cache on (path, mtime, size) so a changed file is re-read
+        stat = os.stat(image_path)
+        return _file_data_url(image_path, stat.st_mtime_ns, stat.st_size)
     
-    def process_image(self, image_path: str, language: str = "Arabic and English") -> Dict:
+    def _render_page(self, page) -> bytes:
         """
-        Extract text from image using GPT-4 Vision
+        Render a PDF page to JPEG, entirely in memory
         
         Args:
-            image_path: Path to image file
-            language: Expected language in image
+            page: fitz.Page to render
             
         Returns:
-            Dict with extracted text and metadata
+            JPEG encoded bytes
         """
-        try:
-            # Encode image
-            base64_image = self.encode_image(image_path)
+        import fitz
+        
+        # 2x resolution, capped so the longer side stays within MAX_IMAGE_SIDE
+        rect = page.rect
+        scale = min(2.0, MAX_IMAGE_SIDE / max(rect.width, rect.height))
+        pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale), alpha=False)
+        
+        if cv2 is not None:
+            # Encode with libjpeg-turbo from a zero-copy view of the raster;
+            # pix.samples would copy it into a new bytes object first
+            arr = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.h, pix.w, pix.n)
+            if pix.n == 3:
+                arr = cv2.cvtColor(arr, cv2.COLOR_RGB2BGR)
+            ok, buffer = cv2.imencode('.jpg', arr, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+            if ok:
+                return buffer.tobytes()
+        
+        return pix.tobytes("jpeg", jpg_quality=JPEG_QUALITY)
+    
+    def _vision_request(self, image_url: str, language: str = "Arabic and English") -> Dict:
+        """
+        Build the chat completion arguments for an OCR request
+        
+        Args:
+            image_url: data: URL of the JPEG image
+            language: Expected language in image
             
-            # Create prompt
-            prompt = f"""Extract ALL text from this image in {language}. 
+        Returns:
+            Keyword arguments for chat.completions.create
+        """
+        prompt = f"""Extract ALL text from this image in {language}. 
 
 Rules:
 1. Preserve the original layout and structure
@@ -60,26 +166,50 @@ Rules:
 6. If text is unclear, note it with [unclear]
 
 Return ONLY the extracted text, no explanations."""
+        
+        return {
+            'model': self.model,
+            'messages': [
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": prompt},
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": image_url
+                            }
+                        }
+                    ]
+                }
+            ],
+            'max_tokens': 2000,
+            'temperature': 0.1
+        }
+    
+    def process_image(self,
+                      image_path: Optional[str] = None,
+                      language: str = "Arabic and English",
+                      image_url: Optional[str] = None) -> Dict:
+        """
+        Extract text from image using GPT-4 Vision
+        
+        Args:
+            image_path: Path to image file
+            language: Expected language in image
+            image_url: data: URL of an already encoded JPEG, used instead of image_path
+            
+        Returns:
+            Dict with extracted text and metadata
+        """
+        try:
+            # Encode image
+            if image_url is None:
+                image_url = self._image_url(image_path)
             
             # Call GPT-4 Vision
             response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}"
-                                }
-                            }
-                        ]
-                    }
-                ],
-                max_tokens=2000,
-                temperature=0.1
+                **self._vision_request(image_url, language)
             )
             
             extracted_text = response.choices[0].message.content
@@ -99,6 +229,19 @@ Return ONLY the extracted text, no explanations."""
                 'method': 'gpt4_vision'
             }
     
+    def _ocr_bytes(self, data: bytes, language: str = "Arabic and English") -> Dict:
+        """
+        Extract text from in-memory JPEG bytes
+        
+        Args:
+            data: JPEG encoded image, e.g. from _render_page
+            language: Expected language in image
+            
+        Returns:
+            Dict with extracted text and metadata
+        """
+        return self.process_image(image_url=_data_url(data), language=language)
+    
     def process_pdf_page_as_image(self, pdf_path: str, page_num: int = 0) -> Dict:
         """
         Convert PDF page to image and extract text
@@ -114,52 +257,108 @@ Return ONLY the extracted text, no explanations."""
             import fitz  # PyMuPDF
             
             # Open PDF
-            doc = fitz.open(pdf_path)
-            
-            if page_num >= len(doc):
-                return {
-                    'text': '',
-                    'status': 'error',
-                    'error': f'Page {page_num} does not exist'
-                }
-            
-            # Get page
-            page = doc[page_num]
-            
-            # Convert to image
-            pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))  # 2x resolution
-            img_data = pix.tobytes("png")
-            
-            # Save temporarily
-            temp_path = f"temp_page_{page_num}.png"
-            with open(temp_path, "wb") as f:
-                f.write(img_data)
+            with fitz.open(pdf_path) as doc:
+                if page_num >= len(doc):
+                    return {
+                        'text': '',
+                        'status': 'error',
+                        'error': f'Page {page_num} does not exist'
+                    }
+                
+                # Convert to image
+                image_bytes = self._render_page(doc[page_num])
             
             # Process with OCR
-            result = self.process_image(temp_path)
+            return self._ocr_bytes(image_bytes)
             
-            # Clean up
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
+        except Exception as e:
+            return {
+                'text': '',
+                'status': 'error',
+                'error': str(e)
+            }
+    
+    async def _process_page_async(self,
+                                  client: AsyncOpenAI,
+                                  semaphore: asyncio.Semaphore,
+                                  image_url: str) -> Dict:
+        """
+        Extract text from one rendered page with the async client
+        
+        Args:
+            client: AsyncOpenAI client shared by all pages
+            semaphore: Bounds the number of requests in flight
+            image_url: data: URL of the page image
             
-            doc.close()
+        Returns:
+            Dict with extracted text and metadata
+        """
+        try:
+            async with semaphore:
+                response = await client.chat.completions.create(
+                    **self._vision_request(image_url)
+                )
             
-            return result
+            return {
+                'text': response.choices[0].message.content,
+                'status': 'success',
+                'method': 'gpt4_vision',
+                'model': self.model
+            }
             
         except Exception as e:
             return {
                 'text': '',
                 'status': 'error',
-                'error': str(e)
+                'error': str(e),
+                'method': 'gpt4_vision'
             }
     
-    def process_scanned_pdf(self, pdf_path: str, max_pages: int = 3) -> Dict:
+    async def _process_pages_async(self, page_images: List[str]) -> List[Dict]:
+        """Send all page images to GPT-4 Vision concurrently"""
+        # The async client is bound to this event loop, so it lives only
+        # for the duration of one scanned PDF
+        client = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            http_client=async_http_client()
+        )
+        try:
+            semaphore = asyncio.Semaphore(OCR_CONCURRENCY)
+            return await asyncio.gather(*[
+                self._process_page_async(client, semaphore, image_url)
+                for image_url in page_images
+            ])
+        finally:
+            await client.close()
+    
+    def process_scanned_pdf(self, pdf_path: str, max_pages: int = 3, doc=None) -> Dict:
         """
         Process entire scanned PDF
         
+        Synchronous wrapper around aprocess_scanned_pdf; safe to call from
+        a thread that already runs an event loop.
+        
         Args:
             pdf_path: Path to PDF file
             max_pages: Maximum pages to process
+            doc: Already open fitz.Document for pdf_path, to avoid reparsing it
+            
+        Returns:
+            Dict with all extracted text
+        """
+        return run_coroutine(self.aprocess_scanned_pdf(pdf_path, max_pages, doc))
+    
+    async def aprocess_scanned_pdf(self, pdf_path: str, max_pages: int = 3, doc=None) -> Dict:
+        """
+        Process entire scanned PDF
+        
+        Pages are rendered up front, then OCRed concurrently (at most
+        OCR_CONCURRENCY requests in flight).
+        
+        Args:
+            pdf_path: Path to PDF file
+            max_pages: Maximum pages to process
+            doc: Already open fitz.Document for pdf_path, to avoid reparsing it
             
         Returns:
             Dict with all extracted text
@@ -167,27 +366,36 @@ Return ONLY the extracted text, no explanations."""
         try:
             import fitz
             
-            doc = fitz.open(pdf_path)
+            if doc is None:
+                with fitz.open(pdf_path) as doc:
+                    return await self.aprocess_scanned_pdf(pdf_path, max_pages, doc)
+            
             num_pages = min(len(doc), max_pages)
             
-            all_text = []
+            # Rendering is fast and CPU-bound; only the API calls are awaited
+            page_images = [
+                _data_url(self._render_page(page))
+                for page in doc.pages(0, num_pages)
+            ]
+            
+            results = await self._process_pages_async(page_images)
+            
+            all_text = io.StringIO()
             pages_data = []
             
-            for page_num in range(num_pages):
-                result = self.process_pdf_page_as_image(pdf_path, page_num)
-                
+            for page_num, result in enumerate(results):
                 if result['status'] == 'success':
+                    if pages_data:
+                        all_text.write('\n\n')
                     pages_data.append({
                         'page_number': page_num + 1,
                         'text': result['text'],
                         'char_count': len(result['text'])
                     })
-                    all_text.append(f"[Page {page_num + 1}]\n{result['text']}")
-            
-            doc.close()
+                    all_text.write(f"[Page {page_num + 1}]\n{result['text']}")
             
             return {
-                'text': '\n\n'.join(all_text),
+                'text': all_text.getvalue(),
                 'pages': pages_data,
                 'status': 'success',
                 'method': 'gpt4_vision_ocr',
@@ -215,18 +423,16 @@ Return ONLY the extracted text, no explanations."""
         try:
             import fitz
             
-            doc = fitz.open(pdf_path)
-            
-            # Check first page
-            page = doc[0]
-            text = page.get_text()
+            with fitz.open(pdf_path) as doc:
+                # Check first page, stopping as soon as it has enough text
+                total = 0
+                for block in doc[0].get_text("blocks"):
+                    total += len(block[4].strip())
+                    if total >= SCANNED_TEXT_MIN_CHARS:
+                        return False
             
             # If very little text, likely scanned
-            is_scanned = len(text.strip()) < 500  #50
-            
-            doc.close()
-            
-            return is_scanned
+            return True
             
         except Exception as e:
             print(f"Error detecting PDF type: {e}")
@@ -0,0 +1,41 @@
+"""
+HTTP settings and helpers shared by the OpenAI API clients
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+
+# Connection pool for every OpenAI client. HTTP/2 multiplexes concurrent
+# requests (embedding batches, OCR pages) over a few connections, and idle
+# ones are kept for two minutes so calls between user actions skip the TLS
+# handshake.
+HTTP_LIMITS = httpx.Limits(
+    max_connections=32,
+    max_keepalive_connections=32,
+    keepalive_expiry=120
+)
+HTTP_TIMEOUT = 60.0
+
+def sync_http_client() -> httpx.Client:
+    """New HTTP/2 keep-alive client for a synchronous OpenAI client"""
+    return httpx.Client(http2=True, limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+
+def async_http_client() -> httpx.AsyncClient:
+    """New HTTP/2 keep-alive client for an AsyncOpenAI client, bound to the running loop"""
+    return httpx.AsyncClient(http2=True, limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+
+def run_coroutine(coro):
+    """
+    Run a coroutine to completion from synchronous code
+
+    asyncio.run refuses to start inside a thread whose event loop is
+    already running (e.g. when called from an async handler), so in that
+    case the coroutine gets its own loop on a worker thread.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
@@ -1,16 +1,39 @@
 """
 RAG Engine - Retrieval Augmented Generation
 """
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
+import asyncio
+import hashlib
 import os
-from typing import List, Dict, Optional
+import re
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Optional, Tuple
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Upper bound on retrieved text put into the prompt; lowest-ranked chunks
+# are dropped first
+MAX_CONTEXT_CHARS = 12000
+
+# Max generated answers kept in memory, keyed on the exact prompt sent
+RESPONSE_CACHE_SIZE = 128
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
 class RAGEngine:
     """Handle RAG queries and response generation"""
     
+    # One retrieved chunk as it appears in the prompt context
+    _CTX_TEMPLATE = (
+        "[مستند {i} | Document {i}]\n"
+        "المصدر | Source: {n} (صفحة | Page {p})\n"
+        "النص | Text:\n"
+        "{t}\n"
+        "---\n"
+    )
+    
     def __init__(self, vector_store):
         """
         Initialize RAG engine
@@ -21,6 +44,10 @@ class RAGEngine:
         self.vector_store = vector_store
         self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
         
+        # LRU cache of answers keyed on a digest of (model, messages)
+        self._response_cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        
         # System prompt for RAG
         self.system_prompt = """أنت مساعد ذكي متخصص في الإجابة على الأسئلة بناءً على المستندات المقدمة فقط.
 
@@ -41,6 +68,60 @@ Important rules:
 5. If the answer is unclear, mention that
 """
     
+    def _build_messages(self,
+                        query: str,
+                        context_docs: List[str],
+                        metadata: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
+        """
+        Build the chat messages for a RAG answer
+        
+        Returns:
+            (messages, metadata of the chunks that made it into the context)
+        """
+        # Build context from retrieved documents
+        context, used_metadata = self._build_context(context_docs, metadata)
+        
+        messages = [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": f"""السياق من المستندات:
+{context}
+
+السؤال: {query}
+
+الرجاء الإجابة بناءً على السياق أعلاه فقط، مع ذكر المصادر.
+
+Context from documents:
+{context}
+
+Question: {query}
+
+Please answer based only on the context above, citing sources.
+"""}
+        ]
+        
+        return messages, used_metadata
+    
+    def _cache_key(self, model: str, messages: List[Dict]) -> str:
+        """Digest of the exact model and messages sent"""
+        return hashlib.sha256(
+            "\x00".join([model] + [m["content"] for m in messages]).encode('utf-8')
+        ).hexdigest()
+    
+    def _cached_answer(self, key: str) -> Optional[str]:
+        """Return a previously generated answer, if any"""
+        with self._cache_lock:
+            answer = self._response_cache.get(key)
+            if answer is not None:
+                self._response_cache.move_to_end(key)
+            return answer
+    
+    def _store_answer(self, key: str, answer: str):
+        """Remember a generated answer, evicting the oldest past the limit"""
+        with self._cache_lock:
+            self._response_cache[key] = answer
+            if len(self._response_cache) > RESPONSE_CACHE_SIZE:
+                self._response_cache.popitem(last=False)
+    
     def generate_response(self, 
                          query: str, 
                          context_docs: List[str],
@@ -49,6 +130,9 @@ Important rules:
         """
         Generate response using RAG
         
+        Answers are cached per exact prompt, so repeating a question over
+        the same retrieved chunks doesn't call the API again.
+        
         Args:
             query: User question
             context_docs: Retrieved document chunks
@@ -59,56 +143,87 @@ Important rules:
             Dict with keys: answer, sources, model_used
         """
         try:
-            # Build context from retrieved documents
-            context = self._build_context(context_docs, metadata)
+            messages, used_metadata = self._build_messages(query, context_docs, metadata)
             
-            # Build messages
-            messages = [
-                {"role": "system", "content": self.system_prompt},
-                {"role": "user", "content": f"""السياق من المستندات:
-{context}
-
-السؤال: {query}
-
-الرجاء الإجابة بناءً على السياق أعلاه فقط، مع ذكر المصادر.
-
-Context from documents:
-{context}
-
-Question: {query}
-
-Please answer based only on the context above, citing sources.
-"""}
-            ]
+            # Generate response, unless this exact prompt was answered before
+            key = self._cache_key(model, messages)
+            answer = self._cached_answer(key)
             
-            # Generate response
-            response = self.client.chat.completions.create(
-                model=model,
-                messages=messages,
-                temperature=0.3,
-                max_tokens=1000
-            )
+            if answer is None:
+                response = self.client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=0.3,
+                    max_tokens=1000
+                )
+                
+                answer = response.choices[0].message.content
+                self._store_answer(key, answer)
+            
+            return self._response_result(answer, used_metadata, model)
+            
+        except Exception as e:
+            return self._response_error(e, model)
+    
+    async def agenerate_response(self,
+                                 client: AsyncOpenAI,
+                                 query: str,
+                                 context_docs: List[str],
+                                 metadata: List[Dict],
+                                 model: str = "gpt-4o-mini") -> Dict:
+        """
+        Async version of generate_response, sharing its answer cache
+        
+        Args:
+            client: AsyncOpenAI client to send the request with
+            query: User question
+            context_docs: Retrieved document chunks
+            metadata: Metadata for each chunk
+            model: OpenAI model to use
             
-            answer = response.choices[0].message.content
+        Returns:
+            Dict with keys: answer, sources, model_used
+        """
+        try:
+            messages, used_metadata = self._build_messages(query, context_docs, metadata)
             
-            # Extract sources
-            sources = self._extract_sources(metadata)
+            key = self._cache_key(model, messages)
+            answer = self._cached_answer(key)
             
-            return {
-                'answer': answer,
-                'sources': sources,
-                'model_used': model,
-                'success': True
-            }
+            if answer is None:
+                response = await client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=0.3,
+                    max_tokens=1000
+                )
+                
+                answer = response.choices[0].message.content
+                self._store_answer(key, answer)
+            
+            return self._response_result(answer, used_metadata, model)
             
         except Exception as e:
-            return {
-                'answer': f"Error generating response: {str(e)}",
-                'sources': [],
-                'model_used': model,
-                'success': False,
-                'error': str(e)
-            }
+            return self._response_error(e, model)
+    
+    def _response_result(self, answer: str, metadata: List[Dict], model: str) -> Dict:
+        """Wrap a generated answer with its sources"""
+        return {
+            'answer': answer,
+            'sources': self._extract_sources(metadata),
+            'model_used': model,
+            'success': True
+        }
+    
+    def _response_error(self, e: Exception, model: str) -> Dict:
+        """Result returned when answer generation fails"""
+        return {
+            'answer': f"Error generating response: {str(e)}",
+            'sources': [],
+            'model_used': model,
+            'success': False,
+            'error': str(e)
+        }
     
     def query(self, 
              question: str, 
@@ -137,17 +252,9 @@ Please answer based only on the context above, citing sources.
             
             # Check if any documents found
             if not documents:
-                return {
-                    'answer': "لا توجد مستندات ذات صلة للإجابة على هذا السؤال.\n\nNo relevant documents found to answer this question.",
-                    'sources': [],
-                    'success': False
-                }
+                return self._no_documents_result()
             
-            # Step 2: Check if visualization is needed
-            viz_keywords = ['table', 'chart', 'graph', 'compare', 'comparison','بياني','رسم','جدول', 'مخطط', 'مقارنة', 'قارن']
-            needs_visualization = any(keyword in question.lower() for keyword in viz_keywords)
-            
-            # Step 3: Generate response
+            # Step 2: Generate response
             result = self.generate_response(
                 query=question,
                 context_docs=documents,
@@ -155,53 +262,170 @@ Please answer based only on the context above, citing sources.
                 model=model
             )
             
-            # Step 4: Add visualization flag
-            result['needs_visualization'] = needs_visualization
-            result['documents'] = documents
-            result['metadatas'] = metadata
+            return self._finish_query(result, question, documents, metadata)
+            
+        except Exception as e:
+            return self._query_error(e)
+    
+    async def aquery(self,
+                     question: str,
+                     n_results: int = 5,
+                     model: str = "gpt-4o-mini",
+                     client: Optional[AsyncOpenAI] = None) -> Dict:
+        """
+        Async version of query
+        
+        The vector store search runs off the event loop and the answer is
+        generated with AsyncOpenAI, so many queries can be in flight at once.
+        
+        Args:
+            question: User question
+            n_results: Number of documents to retrieve
+            model: OpenAI model to use
+            client: AsyncOpenAI client to reuse; one is created if omitted
+            
+        Returns:
+            Dict with answer and sources
+        """
+        if client is None:
+            async with self._async_client() as client:
+                return await self.aquery(question, n_results, model, client)
+        
+        try:
+            search_results = await self.vector_store.asearch(
+                query=question,
+                n_results=n_results
+            )
+            
+            documents = search_results['documents']
+            metadata = search_results['metadatas']
+            
+            if not documents:
+                return self._no_documents_result()
+            
+            result = await self.agenerate_response(
+                client,
+                query=question,
+                context_docs=documents,
+                metadata=metadata,
+                model=model
+            )
             
-            return result
+            return self._finish_query(result, question, documents, metadata)
             
         except Exception as e:
-            return {
-                'answer': f"Error processing query: {str(e)}",
-                'sources': [],
-                'success': False,
-                'error': str(e)
-            }
+            return self._query_error(e)
+    
+    async def batch_query(self,
+                          questions: List[str],
+                          n_results: int = 5,
+                          model: str = "gpt-4o-mini") -> List[Dict]:
+        """
+        Answer several questions concurrently
+        
+        Args:
+            questions: User questions
+            n_results: Number of documents to retrieve per question
+            model: OpenAI model to use
+            
+        Returns:
+            List of results in the same order as questions
+        """
+        async with self._async_client() as client:
+            return await asyncio.gather(*[
+                self.aquery(question, n_results, model, client)
+                for question in questions
+            ])
+    
+    def _async_client(self) -> AsyncOpenAI:
+        """
+        New AsyncOpenAI client, for use as an async context manager
+        
+        Async clients are tied to the event loop they run on, so one is
+        created per aquery/batch_query call rather than kept on the engine.
+        """
+        return AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    
+    def _finish_query(self,
+                      result: Dict,
+                      question: str,
+                      documents: List[str],
+                      metadata: List[Dict]) -> Dict:
+        """Attach the visualization flag and retrieved chunks to a result"""
+        # Check if visualization is needed
+        viz_keywords = ['table', 'chart', 'graph', 'compare', 'comparison','بياني','رسم','جدول', 'مخطط', 'مقارنة', 'قارن']
+        result['needs_visualization'] = any(keyword in question.lower() for keyword in viz_keywords)
+        result['documents'] = documents
+        result['metadatas'] = metadata
+        
+        return result
     
-    def _build_context(self, documents: List[str], metadata: List[Dict]) -> str:
-        """Build context string from retrieved documents"""
+    def _no_documents_result(self) -> Dict:
+        """Result returned when retrieval finds nothing"""
+        return {
+            'answer': "لا توجد مستندات ذات صلة للإجابة على هذا السؤال.\n\nNo relevant documents found to answer this question.",
+            'sources': [],
+            'success': False
+        }
+    
+    def _query_error(self, e: Exception) -> Dict:
+        """Result returned when a query fails"""
+        return {
+            'answer': f"Error processing query: {str(e)}",
+            'sources': [],
+            'success': False,
+            'error': str(e)
+        }
+    
+    def _build_context(self, documents: List[str], metadata: List[Dict]) -> Tuple[str, List[Dict]]:
+        """
+        Build context string from retrieved documents
+        
+        Chunks that are identical up to whitespace are included once, and
+        chunks past MAX_CONTEXT_CHARS are dropped. Documents arrive in
+        similarity order, so the least relevant ones go first.
+        
+        Returns:
+            (context, metadata of the chunks kept), so sources only cite
+            what the model actually saw
+        """
         context_parts = []
+        used_metadata = []
+        seen = set()
+        total_chars = 0
         
-        for idx, (doc, meta) in enumerate(zip(documents, metadata), 1):
-            doc_name = meta.get('document_name', 'Unknown')
-            page = meta.get('page', 'Unknown')
-            
-            context_parts.append(f"""[مستند {idx} | Document {idx}]
-المصدر | Source: {doc_name} (صفحة | Page {page})
-النص | Text:
-{doc}
----
-""")
+        for doc, meta in zip(documents, metadata):
+            key = hashlib.blake2b(
+                _WHITESPACE_RE.sub(' ', doc).strip().encode('utf-8'),
+                digest_size=8
+            ).digest()
+            if key in seen:
+                continue
+            seen.add(key)
+            
+            if context_parts and total_chars + len(doc) > MAX_CONTEXT_CHARS:
+                break
+            total_chars += len(doc)
+            
+            context_parts.append(self._CTX_TEMPLATE.format(
+                i=len(context_parts) + 1,
+                n=meta.get('document_name', 'Unknown'),
+                p=meta.get('page', 'Unknown'),
+                t=doc
+            ))
+            used_metadata.append(meta)
         
-        return "\n".join(context_parts)
+        return "\n".join(context_parts), used_metadata
     
     def _extract_sources(self, metadata: List[Dict]) -> List[str]:
         """Extract unique sources from metadata"""
-        sources = []
-        seen = set()
-        
-        for meta in metadata:
-            doc_name = meta.get('document_name', 'Unknown')
-            page = meta.get('page', 'Unknown')
-            source = f"{doc_name} - Page {page}"
-            
-            if source not in seen:
-                sources.append(source)
-                seen.add(source)
+        # dict keeps first-seen order; format each source only once
+        seen = dict.fromkeys(
+            (meta.get('document_name', 'Unknown'), meta.get('page', 'Unknown'))
+            for meta in metadata
+        )
         
-        return sources
+        return [f"{doc_name} - Page {page}" for doc_name, page in seen]
     
     def summarize_document(self, document_name: str) -> Dict:
         """
@@ -0,0 +1,121 @@
+"""
+Tests for DocumentProcessor chunking
+"""
+import os
+import random
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from document_processor import (
+    DocumentProcessor,
+    _boundary_codepoints,
+    _chunk_bounds_jit,
+    _chunk_bounds_py,
+)
+
+# Characters the random texts are drawn from: plain letters plus every
+# piece of CHUNK_BOUNDARIES, so boundaries land at all sorts of offsets
+ALPHABET = ['a', 'b', 'ب', 'ت', ' ', ' ', '.', '؟', '。', '！', '\n']
+
+
+def random_text(rng, length):
+    return ''.join(rng.choice(ALPHABET) for _ in range(length))
+
+
+def kernel_bounds(text, chunk_size, overlap, kernel=_chunk_bounds_py):
+    codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+    punct_codes, punct_lengths = _boundary_codepoints()
+    return kernel(codes, chunk_size, overlap, punct_codes, punct_lengths)
+
+
+def kernel_chunks(text, chunk_size, overlap):
+    """Chunks as iter_chunks builds them from the compiled scan's offsets"""
+    chunks = []
+    for start, end in kernel_bounds(text, chunk_size, overlap):
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+    return chunks
+
+
+class TestChunkBoundsKernel(unittest.TestCase):
+
+    def setUp(self):
+        self.processor = DocumentProcessor()
+
+    def test_kernel_matches_regex_path(self):
+        rng = random.Random(0)
+        for _ in range(200):
+            text = random_text(rng, rng.randint(1, 3000))
+            chunk_size = rng.randint(20, 400)
+            overlap = rng.randint(0, chunk_size + 50)
+
+            with self.subTest(length=len(text), chunk_size=chunk_size, overlap=overlap):
+                # Short texts always take the regex path in iter_chunks
+                self.assertEqual(
+                    kernel_chunks(text, chunk_size, overlap),
+                    self.processor.chunk_text(text, chunk_size, overlap)
+                )
+
+    @unittest.skipIf(_chunk_bounds_jit is None, "numba not installed")
+    def test_compiled_kernel_matches_python_kernel(self):
+        rng = random.Random(1)
+        for _ in range(50):
+            text = random_text(rng, rng.randint(1, 5000))
+            chunk_size = rng.randint(20, 400)
+            overlap = rng.randint(0, chunk_size + 50)
+
+            with self.subTest(length=len(text), chunk_size=chunk_size, overlap=overlap):
+                np.testing.assert_array_equal(
+                    kernel_bounds(text, chunk_size, overlap, kernel=_chunk_bounds_jit),
+                    kernel_bounds(text, chunk_size, overlap)
+                )
+
+
+class TestChunkText(unittest.TestCase):
+
+    def setUp(self):
+        self.processor = DocumentProcessor()
+
+    def assertChunks(self, text, chunk_size, overlap, expected):
+        """Check chunk_text, and the kernel path for the same input"""
+        self.assertEqual(self.processor.chunk_text(text, chunk_size, overlap), expected)
+        self.assertEqual(kernel_chunks(text, chunk_size, overlap), expected)
+
+    def test_breaks_at_boundary_closest_to_window_end(self):
+        # '؟' comes first in the window, '. ' last; the window ends after '. '
+        text = 'aaaa؟ bbbb. cccc' + 'd' * 50
+        chunks = self.processor.chunk_text(text, 14, 0)
+        self.assertEqual(chunks[:2], ['aaaa؟ bbbb.', 'ccccdddddddddd'])
+
+    def test_blank_line_run_is_one_boundary(self):
+        # The window ends inside the run; the break still comes after all of it
+        self.assertChunks('aaaa\n\n\nbbbbbbbb', 7, 0, ['aaaa', 'bbbbbbb', 'b'])
+
+    def test_overlap_repeats_window_tail(self):
+        self.assertChunks('abcdefghij' * 2, 10, 3, ['abcdefghij', 'hijabcdefg', 'efghij'])
+
+    def test_overlap_at_least_window_still_advances(self):
+        text = 'abcdefghij' * 3
+        for overlap in (10, 25):
+            with self.subTest(overlap=overlap):
+                self.assertChunks(text, 10, overlap, ['abcdefghij'] * 3)
+
+    def test_boundary_before_overlap_still_advances(self):
+        # The break at offset 4 is inside the overlap, so the next chunk
+        # starts at the break instead of stepping back before it
+        self.assertChunks(
+            'ab. ' + 'c' * 30, 10, 5,
+            ['ab.'] + ['c' * 10] * 5 + ['c' * 5]
+        )
+
+    def test_empty_text_has_no_chunks(self):
+        self.assertEqual(self.processor.chunk_text('', 10, 5), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
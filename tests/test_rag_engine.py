@@ -0,0 +1,63 @@
+"""
+Tests for RAGEngine context building and source extraction
+"""
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+from rag_engine import MAX_CONTEXT_CHARS, RAGEngine
+
+
+class FakeCompletions:
+    """Stands in for client.chat.completions, recording each request"""
+    
+    def __init__(self):
+        self.calls = []
+    
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        message = SimpleNamespace(content="answer")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+class TestSources(unittest.TestCase):
+    
+    def setUp(self):
+        self.engine = RAGEngine(vector_store=None)
+        self.completions = FakeCompletions()
+        self.engine.client = SimpleNamespace(chat=SimpleNamespace(completions=self.completions))
+    
+    def test_chunk_past_context_cap_is_not_a_source(self):
+        documents = ["short chunk", "x" * MAX_CONTEXT_CHARS]
+        metadata = [
+            {"document_name": "kept.pdf", "page": 1},
+            {"document_name": "dropped.pdf", "page": 2}
+        ]
+        
+        result = self.engine.generate_response("question", documents, metadata)
+        
+        self.assertTrue(result['success'])
+        self.assertEqual(result['sources'], ["kept.pdf - Page 1"])
+        prompt = self.completions.calls[0]['messages'][1]['content']
+        self.assertNotIn("dropped.pdf", prompt)
+    
+    def test_duplicate_chunk_is_cited_once(self):
+        documents = ["same  text", "same text"]
+        metadata = [
+            {"document_name": "a.pdf", "page": 1},
+            {"document_name": "b.pdf", "page": 4}
+        ]
+        
+        context, used_metadata = self.engine._build_context(documents, metadata)
+        
+        self.assertEqual(used_metadata, metadata[:1])
+        self.assertNotIn("b.pdf", context)
+
+
+if __name__ == "__main__":
+    unittest.main()
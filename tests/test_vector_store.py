@@ -0,0 +1,258 @@
+"""
+Tests for the VectorStore caches and chunk index
+"""
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+import chromadb
+from chromadb.config import Settings
+import vector_store
+from vector_store import (
+    CACHE_LOOKUP_CHUNK,
+    COLLECTION_METADATA,
+    ChunkIndex,
+    EmbeddingCache,
+    VectorStore,
+)
+
+# Dimension of the fake embeddings; Chroma only needs it to be consistent
+DIM = 16
+
+
+def temp_dir(test):
+    """Fresh directory removed when the test finishes"""
+    path = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, path, ignore_errors=True)
+    return path
+
+
+def fake_embedding(text):
+    """Deterministic pseudo-random embedding, standing in for the API"""
+    seed = int(hashlib.sha256(text.encode('utf-8')).hexdigest()[:8], 16)
+    return np.random.default_rng(seed).standard_normal(DIM).astype(np.float32)
+
+
+def offline_store(path):
+    """VectorStore whose embeddings come from fake_embedding instead of OpenAI"""
+    store = VectorStore(persist_directory=path)
+    store._embed_uncached = lambda texts, batch_size: [
+        fake_embedding(text).astype(np.float16) for text in texts
+    ]
+    store._query_embedding = lambda query, model: fake_embedding(query)
+    return store
+
+
+def add_chunks(store, document_name, ids):
+    """Index one chunk per ID for document_name"""
+    return store.add_documents(
+        chunks=[f"{document_name} chunk {chunk_id}" for chunk_id in ids],
+        metadatas=[{'document_name': document_name} for _ in ids],
+        ids=ids
+    )
+
+
+class TestEmbeddingCache(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(temp_dir(self), "embcache.sqlite3")
+        self.cache = EmbeddingCache(self.path)
+
+    def test_round_trip_at_float16_precision(self):
+        embedding = [0.1, -0.25, 0.333333]
+        self.cache.set_many(["text"], [embedding])
+
+        cached = self.cache.get_many(["text"])[0]
+
+        np.testing.assert_array_equal(cached, np.asarray(embedding, dtype=np.float16))
+
+    def test_missing_text_is_none(self):
+        self.cache.set_many(["known"], [[1.0, 2.0]])
+
+        self.assertEqual(self.cache.get_arrays(["known", "unknown"])[1], None)
+
+    def test_failed_embeddings_are_not_stored(self):
+        self.cache.set_many(["none", "empty"], [None, []])
+
+        self.assertEqual(self.cache.get_many(["none", "empty"]), [None, None])
+
+    def test_key_includes_model(self):
+        self.cache.set_many(["text"], [[1.0, 2.0]])
+
+        with mock.patch.object(vector_store, "EMBEDDING_MODEL", "another-model"):
+            self.assertIsNone(self.cache.get_many(["text"])[0])
+
+    def test_survives_reopen(self):
+        self.cache.set_many(["text"], [[1.0, 2.0]])
+
+        reopened = EmbeddingCache(self.path)
+
+        self.assertEqual(reopened.get_many(["text"])[0], [1.0, 2.0])
+
+    def test_lookup_larger_than_one_query(self):
+        texts = [f"text {i}" for i in range(CACHE_LOOKUP_CHUNK * 2 + 1)]
+        self.cache.set_many(texts, [[float(i)] for i in range(len(texts))])
+
+        cached = self.cache.get_arrays(texts)
+
+        self.assertEqual([float(vec[0]) for vec in cached], [float(i) for i in range(len(texts))])
+
+
+class TestChunkIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(temp_dir(self), "docindex.sqlite3")
+        self.index = ChunkIndex(self.path)
+
+    def test_ids_are_kept_per_document(self):
+        self.index.add(["a.pdf", "a.pdf", "b.pdf"], ["a_0", "a_1", "b_0"])
+
+        self.assertEqual(sorted(self.index.ids_for("a.pdf")), ["a_0", "a_1"])
+        self.assertEqual(self.index.ids_for("b.pdf"), ["b_0"])
+        self.assertEqual(self.index.ids_for("c.pdf"), [])
+
+    def test_remove_and_remove_ids(self):
+        self.index.add(["a.pdf", "a.pdf", "b.pdf"], ["a_0", "a_1", "b_0"])
+
+        self.index.remove_ids(["a_0"])
+        self.assertEqual(self.index.ids_for("a.pdf"), ["a_1"])
+
+        self.index.remove("a.pdf")
+        self.assertEqual(self.index.ids_for("a.pdf"), [])
+        self.assertEqual(self.index.ids_for("b.pdf"), ["b_0"])
+
+        self.index.clear()
+        self.assertEqual(self.index.ids_for("b.pdf"), [])
+
+    def test_backfill_mark_survives_reopen(self):
+        self.assertTrue(self.index.needs_backfill())
+
+        self.index.mark_backfilled()
+
+        self.assertFalse(ChunkIndex(self.path).needs_backfill())
+
+
+class TestDeleteDocument(unittest.TestCase):
+
+    def setUp(self):
+        self.path = temp_dir(self)
+
+    def add_legacy_chunks(self, document_name, ids):
+        """Write chunks straight to Chroma, as stores from before the chunk index did"""
+        client = chromadb.PersistentClient(
+            path=self.path, settings=Settings(anonymized_telemetry=False)
+        )
+        collection = client.get_or_create_collection(
+            name="documents", metadata=COLLECTION_METADATA
+        )
+        collection.add(
+            ids=ids,
+            embeddings=[fake_embedding(chunk_id).tolist() for chunk_id in ids],
+            documents=[f"legacy {chunk_id}" for chunk_id in ids],
+            metadatas=[{'document_name': document_name} for _ in ids]
+        )
+
+    def test_backfill_records_chunks_from_before_the_index(self):
+        self.add_legacy_chunks("a.pdf", ["old_0", "old_1"])
+
+        store = offline_store(self.path)
+
+        self.assertEqual(sorted(store.chunk_index.ids_for("a.pdf")), ["old_0", "old_1"])
+        self.assertFalse(store.chunk_index.needs_backfill())
+
+    def test_delete_removes_legacy_and_indexed_chunks(self):
+        self.add_legacy_chunks("a.pdf", ["old_0", "old_1"])
+        store = offline_store(self.path)
+        self.assertTrue(add_chunks(store, "a.pdf", ["new_0"]))
+        self.assertTrue(add_chunks(store, "b.pdf", ["b_0"]))
+
+        self.assertTrue(store.delete_document("a.pdf"))
+
+        self.assertEqual(store.collection.get(include=[])['ids'], ["b_0"])
+        self.assertEqual(store.chunk_index.ids_for("a.pdf"), [])
+
+    def test_remove_stale_chunks_keeps_only_the_new_copy(self):
+        self.add_legacy_chunks("a.pdf", ["sha_0", "sha_1"])
+        store = offline_store(self.path)
+        self.assertTrue(add_chunks(store, "a.pdf", ["blake_0"]))
+
+        self.assertTrue(store.remove_stale_chunks("a.pdf", ["blake_0"]))
+
+        self.assertEqual(store.collection.get(include=[])['ids'], ["blake_0"])
+        self.assertEqual(store.chunk_index.ids_for("a.pdf"), ["blake_0"])
+
+
+class TestQueryResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.store = offline_store(temp_dir(self))
+        add_chunks(self.store, "a.pdf", ["a_0", "a_1", "a_2"])
+
+        # "rephrased" is a near-duplicate of "question"; "other" is unrelated
+        question = fake_embedding("question")
+        noise = fake_embedding("noise")
+        vectors = {
+            "question": question,
+            "rephrased": question + 0.01 * noise,
+            "other": fake_embedding("other"),
+        }
+        self.store._query_embedding = lambda query, model: vectors[query]
+
+        self.queries = 0
+        query_collection = self.store._query_collection
+
+        def counting_query(*args):
+            self.queries += 1
+            return query_collection(*args)
+
+        self.store._query_collection = counting_query
+
+    def test_near_duplicate_query_reuses_result(self):
+        first = self.store.search("question", n_results=2)
+        second = self.store.search("rephrased", n_results=2)
+
+        self.assertEqual(self.queries, 1)
+        self.assertEqual(second, first)
+
+    def test_unrelated_query_or_other_params_miss(self):
+        self.store.search("question", n_results=2)
+        self.store.search("other", n_results=2)
+        self.store.search("question", n_results=3)
+
+        self.assertEqual(self.queries, 3)
+
+    def test_write_invalidates_cached_results(self):
+        self.store.search("question", n_results=2)
+        add_chunks(self.store, "b.pdf", ["b_0"])
+        self.store.search("question", n_results=2)
+
+        self.assertEqual(self.queries, 2)
+
+    def test_result_that_raced_a_write_is_not_cached(self):
+        query_collection = self.store._query_collection
+
+        def query_during_write(*args):
+            # A write lands while this search is talking to Chroma
+            self.store._clear_result_cache()
+            return query_collection(*args)
+
+        self.store._query_collection = query_during_write
+        self.store.search("question", n_results=2)
+        self.store._query_collection = query_collection
+        self.store.search("question", n_results=2)
+
+        self.assertEqual(self.queries, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,38 +3,417 @@ Vector store manager using ChromaDB and OpenAI embeddings
 """
 import chromadb
 from chromadb.config import Settings
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI, RateLimitError
+import asyncio
+import functools
+import hashlib
+import json
+import logging
+import numpy as np
 import os
-from typing import List, Dict, Optional
+import queue
+import sqlite3
+import threading
+import time
+from itertools import islice
+from typing import Iterable, List, Dict, Optional, Tuple
 from dotenv import load_dotenv
+from openai_http import async_http_client, sync_http_client
+
+try:
+    import numba
+except ImportError:  # optional; embeddings are normalized with NumPy instead
+    numba = None
 
 # Load environment variables
 load_dotenv()
 
+log = logging.getLogger(__name__)
+
+# The SDK logs every retry at INFO; only its warnings are worth keeping
+logging.getLogger("openai").setLevel(logging.WARNING)
+
+# Repeats of the same warning within this many seconds are counted, not
+# logged, so a rate-limit storm produces one line per interval
+WARNING_SAMPLE_SECONDS = 10.0
+
+_warning_state = {}
+_warning_lock = threading.Lock()
+
+def _warn_sampled(kind: str, message: str, *args):
+    """
+    Log a warning, at most once per WARNING_SAMPLE_SECONDS for each kind
+    
+    Args:
+        kind: Groups repeats of the same warning
+        message: logging format string
+        args: Values for message
+    """
+    now = time.monotonic()
+    with _warning_lock:
+        last, suppressed = _warning_state.get(kind, (0.0, 0))
+        if now - last < WARNING_SAMPLE_SECONDS:
+            _warning_state[kind] = (last, suppressed + 1)
+            return
+        _warning_state[kind] = (now, 0)
+    
+    if suppressed:
+        message += " (%d similar warnings suppressed)"
+        args += (suppressed,)
+    log.warning(message, *args)
+
+# OpenAI embedding model used for chunks and queries
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Inputs per embeddings request; the API takes up to 2048
+EMBED_BATCH_SIZE = 256
+
+# The model takes at most 8191 tokens per input and 300k per request.
+# A token is rarely shorter than a character, so character caps stay
+# under both without a tokenizer.
+MAX_EMBED_CHARS = 8000
+MAX_BATCH_CHARS = 300_000
+
+# Retries for a rate-limited embeddings request; the wait doubles each time
+EMBED_MAX_RETRIES = 5
+EMBED_RETRY_BASE_DELAY = 1.0
+
+# Embedded insert batches waiting for Chroma in add_documents
+INSERT_QUEUE_SIZE = 4
+
+# Chunks read per collection.get page when backfilling the chunk index
+BACKFILL_PAGE_SIZE = 5000
+
+# Recent query embeddings kept in memory by search
+QUERY_CACHE_SIZE = 1024
+
+# Search results reused for queries whose embedding is at least this
+# cosine-similar to an earlier one (typos, light rephrasing)
+QUERY_SIMILARITY_THRESHOLD = 0.98
+QUERY_RESULT_CACHE_SIZE = 512
+
+def _split_batches(texts: List[str], batch_size: int) -> List[List[str]]:
+    """
+    Group texts into requests of at most batch_size inputs and MAX_BATCH_CHARS
+    
+    Args:
+        texts: Already truncated input texts
+        batch_size: Max inputs per request
+        
+    Returns:
+        Batches in input order
+    """
+    batches = []
+    batch = []
+    batch_chars = 0
+    
+    for text in texts:
+        if batch and (len(batch) == batch_size or batch_chars + len(text) > MAX_BATCH_CHARS):
+            batches.append(batch)
+            batch = []
+            batch_chars = 0
+        batch.append(text)
+        batch_chars += len(text)
+    
+    if batch:
+        batches.append(batch)
+    
+    return batches
+
+def _embed_concurrency() -> int:
+    """Embedding requests in flight; OPENAI_EMBED_CONCURRENCY overrides the default"""
+    workers = os.environ.get("OPENAI_EMBED_CONCURRENCY")
+    if workers:
+        return max(1, int(workers))
+    return 8
+
+# Settings for newly created collections. Vectors are normalized before
+# they reach Chroma, so inner product ranks like cosine without the norm
+# work. The HNSW index reads these only at creation: existing collections
+# keep theirs, and changing them needs a reindex (clear and re-upload).
+COLLECTION_METADATA = {
+    "description": "Arabic RAG document collection",
+    "hnsw:space": "ip",
+    "hnsw:search_ef": 200,
+    "hnsw:construction_ef": 200,
+    "hnsw:M": 32
+}
+
+# HNSW raises this when it can't find n_results neighbours, e.g. when
+# search_ef is small for a sparse (or heavily filtered) collection
+HNSW_EF_ERROR = "contigious 2D array"
+
+def _round_f16(embeddings: List[List[float]]) -> List[List[float]]:
+    """
+    Round embeddings through float16, the precision the cache stores
+    
+    Fresh and cached vectors for the same text then come out identical.
+    Empty (failed) embeddings are passed through.
+    """
+    return [
+        np.asarray(emb, dtype=np.float16).astype(np.float32).tolist() if emb else emb
+        for emb in embeddings
+    ]
+
+# Matrices with at least this many rows are normalized by the compiled
+# kernel when numba is installed
+NUMBA_MIN_ROWS = 512
+
+_prange = numba.prange if numba else range
+
+def _normalize_rows_py(x):
+    """In-place unit-length scaling of each row of a 2D float32 array
+
+    Rows of zeros are left alone. Compiled (parallel over rows) with
+    numba when available.
+    """
+    for i in _prange(x.shape[0]):
+        total = 0.0
+        for j in range(x.shape[1]):
+            total += x[i, j] * x[i, j]
+        if total > 0.0:
+            scale = 1.0 / np.sqrt(total)
+            for j in range(x.shape[1]):
+                x[i, j] *= scale
+
+_normalize_rows_jit = (
+    numba.njit(parallel=True, fastmath=True, cache=True)(_normalize_rows_py) if numba else None
+)
+
+def _normalize(embeddings: np.ndarray) -> np.ndarray:
+    """Scale each row to unit length (rows of zeros are left alone)"""
+    if _normalize_rows_jit is not None and embeddings.ndim == 2 and len(embeddings) >= NUMBA_MIN_ROWS:
+        out = np.array(embeddings, dtype=np.float32, order='C')
+        _normalize_rows_jit(out)
+        return out
+    
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+# SQLite has a limit on bound parameters per statement
+CACHE_LOOKUP_CHUNK = 500
+
+class EmbeddingCache:
+    """Persistent embedding cache keyed by sha256(model + text), stored as float16"""
+    
+    def __init__(self, path: str):
+        """
+        Open (or create) the cache database
+        
+        Args:
+            path: SQLite file to store embeddings in
+        """
+        # Shared by the threads that index documents; the lock serializes use
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)"
+            )
+            self._conn.commit()
+    
+    @staticmethod
+    def _key(text: str) -> str:
+        """Cache key; includes the model so switching models doesn't collide"""
+        # sha256 with SHA-NI beats blake3's per-call overhead on chunk-sized
+        # input; changing the key would orphan every cached embedding
+        return hashlib.sha256(f"{EMBEDDING_MODEL}\x00{text}".encode('utf-8')).hexdigest()
+    
+    def get_many(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        Look up cached embeddings
+        
+        Args:
+            texts: Input texts
+            
+        Returns:
+            One embedding per text, None where it isn't cached
+        """
+        return [
+            vec.astype(np.float32).tolist() if vec is not None else None
+            for vec in self.get_arrays(texts)
+        ]
+    
+    def get_arrays(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """
+        Look up cached embeddings as float16 views over the stored bytes
+        
+        Args:
+            texts: Input texts
+            
+        Returns:
+            One array per text, None where it isn't cached
+        """
+        keys = [self._key(text) for text in texts]
+        found = {}
+        
+        with self._lock:
+            for i in range(0, len(keys), CACHE_LOOKUP_CHUNK):
+                chunk = keys[i:i + CACHE_LOOKUP_CHUNK]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk
+                )
+                found.update(rows)
+        
+        return [
+            np.frombuffer(found[key], dtype=np.float16) if key in found else None
+            for key in keys
+        ]
+    
+    def set_many(self, texts: List[str], embeddings: List):
+        """
+        Store embeddings, skipping missing or empty (failed) ones
+        
+        Args:
+            texts: Input texts
+            embeddings: Embedding for each text, as a list or array
+        """
+        rows = [
+            (self._key(text), np.asarray(emb, dtype=np.float16).tobytes())
+            for text, emb in zip(texts, embeddings)
+            if emb is not None and len(emb)
+        ]
+        if not rows:
+            return
+        
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows
+            )
+            self._conn.commit()
+
+class ChunkIndex:
+    """Persistent document name -> chunk ID mapping, so deletes skip Chroma's where filter"""
+    
+    def __init__(self, path: str):
+        """
+        Open (or create) the index database
+        
+        Args:
+            path: SQLite file to store the mapping in
+        """
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS docname_to_ids (docname TEXT, id TEXT PRIMARY KEY)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS docname_idx ON docname_to_ids (docname)"
+            )
+            self._conn.commit()
+    
+    def add(self, document_names: List[str], ids: List[str]):
+        """Record which document each chunk ID belongs to"""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO docname_to_ids (docname, id) VALUES (?, ?)",
+                zip(document_names, ids)
+            )
+            self._conn.commit()
+    
+    def ids_for(self, document_name: str) -> List[str]:
+        """Chunk IDs recorded for a document"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM docname_to_ids WHERE docname = ?", (document_name,)
+            )
+            return [row[0] for row in rows]
+    
+    def remove(self, document_name: str):
+        """Forget a document's chunk IDs"""
+        with self._lock:
+            self._conn.execute("DELETE FROM docname_to_ids WHERE docname = ?", (document_name,))
+            self._conn.commit()
+    
+    def remove_ids(self, ids: List[str]):
+        """Forget individual chunk IDs"""
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM docname_to_ids WHERE id = ?",
+                ((chunk_id,) for chunk_id in ids)
+            )
+            self._conn.commit()
+    
+    def clear(self):
+        """Forget every document"""
+        with self._lock:
+            self._conn.execute("DELETE FROM docname_to_ids")
+            self._conn.commit()
+    
+    def needs_backfill(self) -> bool:
+        """Whether chunks indexed before this mapping existed still need recording"""
+        with self._lock:
+            return self._conn.execute("PRAGMA user_version").fetchone()[0] < 1
+    
+    def mark_backfilled(self):
+        """Record that every chunk already in the collection has been added"""
+        with self._lock:
+            self._conn.execute("PRAGMA user_version = 1")
+            self._conn.commit()
+
 class VectorStore:
     """Manage vector embeddings and similarity search"""
     
-    def __init__(self, persist_directory: str = "vectordb"):
+    def __init__(self, persist_directory: str = "vectordb", insert_batch_size: int = 2000):
         """
         Initialize vector store
         
         Args:
             persist_directory: Directory to persist ChromaDB data
+            insert_batch_size: Max chunks per collection.add call; Chroma
+                handles several moderate inserts much faster than one huge one
         """
+        self.insert_batch_size = insert_batch_size
+        
         # Use PersistentClient instead of Client
         self.client = chromadb.PersistentClient(
             path=persist_directory,
             settings=Settings(anonymized_telemetry=False)
         )
         
-        # Initialize OpenAI client
-        self.openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        # Initialize OpenAI client on a long-lived keep-alive pool
+        self.openai_client = OpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            http_client=sync_http_client()
+        )
+        
+        # The async client for batch embedding is bound to an event loop, so
+        # both are started on first use and kept for the store's lifetime;
+        # its keep-alive connections then carry over between calls
+        self._async_loop = None
+        self._async_loop_lock = threading.Lock()
+        self._async_client = None
         
-        # Get or create collection
-        self.collection = self.client.get_or_create_collection(
-            name="documents",
-            metadata={"description": "Arabic RAG document collection"}
+        # Embeddings survive restarts, so unchanged text is never re-embedded
+        self.embedding_cache = EmbeddingCache(os.path.join(persist_directory, "embcache.sqlite3"))
+        self.chunk_index = ChunkIndex(os.path.join(persist_directory, "docindex.sqlite3"))
+        
+        # Repeated questions skip even the disk cache; keyed on (query, model)
+        self._query_embedding = functools.lru_cache(maxsize=QUERY_CACHE_SIZE)(
+            self._embed_query
         )
+        
+        # Unit-norm vectors of recent queries, row-aligned with their
+        # ((n_results, filter), result) entries; cleared on every write.
+        # The generation counts writes, so a search that overlaps one
+        # doesn't store its possibly stale result afterwards.
+        self._result_cache_lock = threading.Lock()
+        self._result_cache_vecs = None
+        self._result_cache_entries = []
+        self._write_generation = 0
+        
+        # Serialize writes; add_documents may be called from worker threads
+        self._write_lock = threading.Lock()
+        
+        # Get or create collection
+        self.collection = self._open_collection()
+        
+        if self.chunk_index.needs_backfill():
+            self._backfill_chunk_index()
     
     def get_embedding(self, text: str) -> List[float]:
         """
@@ -46,15 +425,194 @@ class VectorStore:
         Returns:
             List of embedding values
         """
-        try:
-            response = self.openai_client.embeddings.create(
-                model="text-embedding-3-small",
-                input=text
+        cached = self.embedding_cache.get_many([text])[0]
+        if cached is not None:
+            return cached
+        
+        delay = EMBED_RETRY_BASE_DELAY
+        
+        for attempt in range(EMBED_MAX_RETRIES + 1):
+            try:
+                response = self.openai_client.embeddings.create(
+                    model=EMBEDDING_MODEL,
+                    input=text[:MAX_EMBED_CHARS]
+                )
+                embedding = _round_f16([response.data[0].embedding])[0]
+                self.embedding_cache.set_many([text], [embedding])
+                return embedding
+            except RateLimitError as e:
+                if attempt == EMBED_MAX_RETRIES:
+                    _warn_sampled("embedding", "Error generating embedding: %s", e)
+                    break
+                time.sleep(delay)
+                delay *= 2
+            except Exception as e:
+                _warn_sampled("embedding", "Error generating embedding: %s", e)
+                break
+        
+        return []
+    
+    def _embed_query(self, query: str, model: str) -> Tuple[float, ...]:
+        """
+        Embed a search query; wrapped in an LRU cache by __init__
+        
+        Args:
+            query: Search query
+            model: Embedding model, part of the cache key so a model change
+                never returns stale vectors
+            
+        Returns:
+            Embedding as an immutable tuple
+        """
+        embedding = self.get_embedding(query)
+        if not embedding:
+            # Raise rather than return, so failures aren't cached
+            raise ValueError("Failed to embed query")
+        return tuple(embedding)
+    
+    def get_embeddings_batch(self,
+                             texts: List[str],
+                             batch_size: int = EMBED_BATCH_SIZE) -> List[List[float]]:
+        """
+        Generate embeddings for many texts, batch_size inputs per request
+        
+        Only texts missing from the embedding cache are sent to the API.
+        
+        Args:
+            texts: Input texts
+            batch_size: Number of texts sent in each API request
+            
+        Returns:
+            One embedding per text, in order; empty lists for texts whose
+            batch failed
+        """
+        matrix, valid = self._embedding_matrix(texts, batch_size)
+        rows = iter(matrix.tolist())
+        return [next(rows) if ok else [] for ok in valid]
+    
+    def _embedding_matrix(self, texts: List[str], batch_size: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Embeddings of texts as one float32 matrix, cache first then the API
+        
+        Vectors stay NumPy arrays from the response or cache bytes onwards,
+        so no per-float Python objects are made until the caller needs lists.
+        
+        Args:
+            texts: Input texts
+            batch_size: Number of texts sent in each API request
+            
+        Returns:
+            (matrix, valid): one row per text that was embedded, in order,
+            and a boolean mask of which texts those are
+        """
+        # Repeated chunks (headers, footers, boilerplate) are looked up and
+        # embedded once, then fanned back out to every position
+        slots = {}
+        positions = [slots.setdefault(text, len(slots)) for text in texts]
+        unique_texts = list(slots)
+        
+        unique_vectors = self.embedding_cache.get_arrays(unique_texts)
+        missing = [i for i, vec in enumerate(unique_vectors) if vec is None]
+        
+        if missing:
+            missing_texts = [unique_texts[i] for i in missing]
+            fresh = self._embed_uncached(missing_texts, batch_size)
+            self.embedding_cache.set_many(missing_texts, fresh)
+            for i, vec in zip(missing, fresh):
+                unique_vectors[i] = vec
+        
+        vectors = [unique_vectors[slot] for slot in positions]
+        valid = np.fromiter((vec is not None for vec in vectors), dtype=bool, count=len(vectors))
+        present = [vec for vec in vectors if vec is not None]
+        if not present:
+            return np.empty((0, 0), dtype=np.float32), valid
+        
+        return np.vstack(present).astype(np.float32, copy=False), valid
+    
+    def _embed_uncached(self, texts: List[str], batch_size: int) -> List[Optional[np.ndarray]]:
+        """Embed texts through the API, batch_size per request; None where a batch failed"""
+        # Overlong inputs would fail the request; cut them to the model limit
+        batches = _split_batches([text[:MAX_EMBED_CHARS] for text in texts], batch_size)
+        results = self._run_async(self._aembed_batches(batches))
+        
+        vectors = []
+        for batch, matrix in zip(batches, results):
+            if matrix is None:
+                vectors.extend(None for _ in batch)
+            else:
+                vectors.extend(matrix)
+        return vectors
+    
+    def _run_async(self, coro):
+        """
+        Run a coroutine on this store's event loop and wait for the result
+        
+        The loop runs on its own daemon thread, started on first use, so
+        this works from any thread, including one already running a loop.
+        """
+        with self._async_loop_lock:
+            if self._async_loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=loop.run_forever,
+                    name="vector-store-io",
+                    daemon=True
+                ).start()
+                self._async_loop = loop
+        return asyncio.run_coroutine_threadsafe(coro, self._async_loop).result()
+    
+    async def _aembed_batches(self, batches: List[List[str]]) -> List[Optional[np.ndarray]]:
+        """Send all batches concurrently; results keep batch order"""
+        # Only ever runs on the store's loop, so this needs no lock
+        if self._async_client is None:
+            self._async_client = AsyncOpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                http_client=async_http_client()
             )
-            return response.data[0].embedding
-        except Exception as e:
-            print(f"Error generating embedding: {e}")
-            return []
+        
+        semaphore = asyncio.Semaphore(_embed_concurrency())
+        return await asyncio.gather(*[
+            self._aembed_batch(self._async_client, semaphore, batch)
+            for batch in batches
+        ])
+    
+    async def _aembed_batch(self,
+                            client: AsyncOpenAI,
+                            semaphore: asyncio.Semaphore,
+                            batch: List[str]) -> Optional[np.ndarray]:
+        """
+        Embed one batch, backing off and retrying while rate limited
+        
+        Args:
+            client: AsyncOpenAI client shared by all batches
+            semaphore: Bounds the number of requests in flight
+            batch: Input texts for a single request
+            
+        Returns:
+            float16 matrix with one row per text, at cache precision, or
+            None if the request failed
+        """
+        delay = EMBED_RETRY_BASE_DELAY
+        
+        for attempt in range(EMBED_MAX_RETRIES + 1):
+            try:
+                async with semaphore:
+                    response = await client.embeddings.create(
+                        model=EMBEDDING_MODEL,
+                        input=batch
+                    )
+                return np.asarray([d.embedding for d in response.data], dtype=np.float16)
+            except RateLimitError as e:
+                if attempt == EMBED_MAX_RETRIES:
+                    _warn_sampled("embedding", "Error generating embeddings: %s", e)
+                    break
+                await asyncio.sleep(delay)
+                delay *= 2
+            except Exception as e:
+                _warn_sampled("embedding", "Error generating embeddings: %s", e)
+                break
+        
+        return None
     
     def add_documents(self, 
                      chunks: List[str], 
@@ -72,34 +630,146 @@ class VectorStore:
             True if successful
         """
         try:
-            # Generate embeddings for all chunks
-            embeddings = [self.get_embedding(chunk) for chunk in chunks]
+            # Embed the next batch while the previous one is being inserted;
+            # the bounded queue keeps at most a few batches in memory
+            step = self.insert_batch_size
+            batches = queue.Queue(maxsize=INSERT_QUEUE_SIZE)
+            errors = []
+            stored = False
             
-            # Filter out failed embeddings
-            valid_data = [
-                (chunk, emb, meta, id_) 
-                for chunk, emb, meta, id_ in zip(chunks, embeddings, metadatas, ids)
-                if emb
-            ]
+            def consume():
+                while True:
+                    batch = batches.get()
+                    if batch is None:
+                        return
+                    if errors:
+                        continue
+                    try:
+                        self._insert_batch(*batch)
+                    except Exception as e:
+                        errors.append(e)
             
-            if not valid_data:
-                return False
+            consumer = threading.Thread(target=consume, daemon=True)
+            consumer.start()
+            try:
+                for i in range(0, len(chunks), step):
+                    if errors:
+                        break
+                    batch = self._prepare_batch(
+                        chunks[i:i + step], metadatas[i:i + step], ids[i:i + step]
+                    )
+                    if batch is not None:
+                        batches.put(batch)
+                        stored = True
+            finally:
+                batches.put(None)
+                consumer.join()
             
-            chunks, embeddings, metadatas, ids = zip(*valid_data)
+            if errors:
+                raise errors[0]
             
-            # Add to collection
+            return stored
+            
+        except Exception as e:
+            _warn_sampled("add", "Error adding documents: %s", e)
+            return False
+    
+    def _prepare_batch(self,
+                       chunks: List[str],
+                       metadatas: List[Dict],
+                       ids: List[str]) -> Optional[Tuple[List[str], List[List[float]], List[Dict], List[str]]]:
+        """
+        Embed one insert batch and drop the chunks whose embedding failed
+        
+        Args:
+            chunks: Text chunks of the batch
+            metadatas: Metadata dict for each chunk
+            ids: Unique ID for each chunk
+            
+        Returns:
+            (chunks, normalized embeddings, metadatas, ids), or None if no
+            chunk could be embedded
+        """
+        # Generate embeddings for all chunks, as one matrix of the ones
+        # that succeeded plus a mask of which those are
+        emb_arr, valid = self._embedding_matrix(list(chunks), EMBED_BATCH_SIZE)
+        
+        if not valid.any():
+            return None
+        
+        if not valid.all():
+            keep = np.flatnonzero(valid)
+            chunks = [chunks[i] for i in keep]
+            metadatas = [metadatas[i] for i in keep]
+            ids = [ids[i] for i in keep]
+        
+        return list(chunks), _normalize(emb_arr).tolist(), list(metadatas), list(ids)
+    
+    def _insert_batch(self,
+                      chunks: List[str],
+                      embeddings: List[List[float]],
+                      metadatas: List[Dict],
+                      ids: List[str]):
+        """Add one prepared batch to the collection and the chunk index"""
+        with self._write_lock:
             self.collection.add(
-                documents=list(chunks),
-                embeddings=list(embeddings),
-                metadatas=list(metadatas),
-                ids=list(ids)
+                documents=chunks,
+                embeddings=embeddings,
+                metadatas=metadatas,
+                ids=ids
             )
+            self.chunk_index.add(
+                [meta.get('document_name', '') for meta in metadatas], ids
+            )
+        self._clear_result_cache()
+    
+    async def aadd_documents(self,
+                             chunks: List[str],
+                             metadatas: List[Dict],
+                             ids: List[str]) -> bool:
+        """
+        add_documents in a worker thread, so async callers aren't blocked
+        
+        Args:
+            chunks: List of text chunks
+            metadatas: List of metadata dicts for each chunk
+            ids: List of unique IDs for each chunk
             
-            return True
+        Returns:
+            True if successful
+        """
+        return await asyncio.to_thread(self.add_documents, chunks, metadatas, ids)
+    
+    def add_texts_batched(self,
+                          items: Iterable[Tuple[str, Dict, str]],
+                          batch_size: int = 64) -> bool:
+        """
+        Add chunks from an iterable in fixed-size batches
+        
+        Only one batch is held in memory at a time, so items can be a
+        generator such as one built on DocumentProcessor.iter_chunks.
+        
+        Args:
+            items: Iterable of (chunk, metadata, id) tuples
+            batch_size: Chunks embedded and stored per add_documents call
             
-        except Exception as e:
-            print(f"Error adding documents: {e}")
-            return False
+        Returns:
+            True if every batch was added
+        """
+        iterator = iter(items)
+        success = True
+        added = False
+        
+        while True:
+            batch = list(islice(iterator, batch_size))
+            if not batch:
+                break
+            
+            chunks, metadatas, ids = zip(*batch)
+            success = self.add_documents(list(chunks), list(metadatas), list(ids)) and success
+            added = True
+        
+        return success and added
     
     def search(self, 
               query: str, 
@@ -117,37 +787,175 @@ class VectorStore:
             Dict with keys: documents, metadatas, distances
         """
         try:
-            # Generate query embedding
-            query_embedding = self.get_embedding(query)
+            # Writes that land after this point invalidate our result
+            with self._result_cache_lock:
+                generation = self._write_generation
             
-            if not query_embedding:
+            # Generate query embedding
+            try:
+                query_embedding = list(self._query_embedding(query, EMBEDDING_MODEL))
+            except ValueError:
                 return {
                     'documents': [],
                     'metadatas': [],
                     'distances': []
                 }
             
+            # Reuse the results of a near-identical earlier query
+            query_vec = _normalize(np.asarray(query_embedding, dtype=np.float32))
+            params = (n_results, json.dumps(filter_dict, sort_keys=True))
+            
+            cached = self._similar_query_result(query_vec, params)
+            if cached is not None:
+                return dict(cached)
+            
             # Search
-            results = self.collection.query(
-                query_embeddings=[query_embedding],
-                n_results=n_results,
-                where=filter_dict
-            )
+            results = self._query_collection(query_vec.tolist(), n_results, filter_dict)
             
-            return {
+            result = {
                 'documents': results['documents'][0] if results['documents'] else [],
                 'metadatas': results['metadatas'][0] if results['metadatas'] else [],
                 'distances': results['distances'][0] if results['distances'] else []
             }
+            self._remember_query_result(query_vec, params, result, generation)
+            
+            return dict(result)
             
         except Exception as e:
-            print(f"Error searching: {e}")
+            _warn_sampled("search", "Error searching: %s", e)
             return {
                 'documents': [],
                 'metadatas': [],
                 'distances': []
             }
     
+    async def asearch(self,
+                      query: str,
+                      n_results: int = 5,
+                      filter_dict: Optional[Dict] = None) -> Dict:
+        """
+        search in a worker thread, so async callers aren't blocked
+        
+        Embedding, the result caches and the Chroma query all run in the
+        one thread hop.
+        
+        Args:
+            query: Search query
+            n_results: Number of results to return
+            filter_dict: Optional metadata filter
+            
+        Returns:
+            Dict with keys: documents, metadatas, distances
+        """
+        return await asyncio.to_thread(self.search, query, n_results, filter_dict)
+    
+    def _open_collection(self):
+        """
+        Open the documents collection, creating it if it doesn't exist
+        
+        COLLECTION_METADATA is only passed when the collection is really
+        new; get_or_create_collection would otherwise overwrite the stored
+        metadata of an existing index with settings it wasn't built with.
+        """
+        try:
+            return self.client.get_collection(name="documents")
+        except ValueError:
+            return self.client.get_or_create_collection(
+                name="documents",
+                metadata=COLLECTION_METADATA
+            )
+    
+    def _query_collection(self,
+                          query_embedding: List[float],
+                          n_results: int,
+                          filter_dict: Optional[Dict]) -> Dict:
+        """
+        collection.query, asking for fewer hits if HNSW can't fill n_results
+        
+        search_ef is fixed when the index is built, so retrying with the
+        same n_results would fail the same way; return what can be found.
+        
+        Args:
+            query_embedding: Normalized query embedding
+            n_results: Number of results wanted
+            filter_dict: Optional metadata filter
+            
+        Returns:
+            Raw Chroma query results
+        """
+        while True:
+            try:
+                return self.collection.query(
+                    query_embeddings=[query_embedding],
+                    n_results=n_results,
+                    where=filter_dict
+                )
+            except RuntimeError as e:
+                if HNSW_EF_ERROR not in str(e) or n_results <= 1:
+                    raise
+                n_results //= 2
+    
+    def _similar_query_result(self, query_vec: np.ndarray, params: Tuple) -> Optional[Dict]:
+        """
+        Find a cached result for a query close enough to query_vec
+        
+        Args:
+            query_vec: Unit-norm query embedding
+            params: (n_results, filter) the result must have been made with
+            
+        Returns:
+            The cached result, or None
+        """
+        with self._result_cache_lock:
+            if self._result_cache_vecs is None:
+                return None
+            
+            # Rows are unit-norm, so the dot product is the cosine similarity
+            sims = self._result_cache_vecs @ query_vec
+            for idx in np.argsort(sims)[::-1]:
+                if sims[idx] < QUERY_SIMILARITY_THRESHOLD:
+                    break
+                entry_params, result = self._result_cache_entries[idx]
+                if entry_params == params:
+                    return result
+        
+        return None
+    
+    def _remember_query_result(self,
+                               query_vec: np.ndarray,
+                               params: Tuple,
+                               result: Dict,
+                               generation: int):
+        """
+        Cache a search result, dropping the oldest past QUERY_RESULT_CACHE_SIZE
+        
+        Args:
+            query_vec: Unit-norm query embedding
+            params: (n_results, filter) the result was made with
+            result: Search result to cache
+            generation: _write_generation when the search started; if the
+                collection changed since, the result is not stored
+        """
+        with self._result_cache_lock:
+            if generation != self._write_generation:
+                return
+            row = query_vec[np.newaxis, :]
+            if self._result_cache_vecs is None:
+                self._result_cache_vecs = row
+            else:
+                self._result_cache_vecs = np.vstack(
+                    [self._result_cache_vecs[-(QUERY_RESULT_CACHE_SIZE - 1):], row]
+                )
+            self._result_cache_entries.append((params, result))
+            del self._result_cache_entries[:-QUERY_RESULT_CACHE_SIZE]
+    
+    def _clear_result_cache(self):
+        """Forget cached search results; called whenever the collection changes"""
+        with self._result_cache_lock:
+            self._write_generation += 1
+            self._result_cache_vecs = None
+            self._result_cache_entries = []
+    
     def delete_document(self, document_name: str) -> bool:
         """
         Delete all chunks from a specific document
@@ -159,21 +967,64 @@ class VectorStore:
             True if successful
         """
         try:
-            # Get all IDs for this document
-            results = self.collection.get(
-                where={"document_name": document_name}
-            )
+            ids = self._document_ids(document_name)
             
-            if results['ids']:
-                self.collection.delete(ids=results['ids'])
+            if ids:
+                with self._write_lock:
+                    self.collection.delete(ids=ids)
+                    self.chunk_index.remove(document_name)
+                self._clear_result_cache()
                 return True
             
             return False
             
         except Exception as e:
-            print(f"Error deleting document: {e}")
+            _warn_sampled("delete", "Error deleting document: %s", e)
             return False
     
+    def remove_stale_chunks(self, document_name: str, keep_ids: List[str]) -> bool:
+        """
+        Delete a document's chunks other than keep_ids
+        
+        Called after re-indexing a document, so chunks stored under IDs
+        from an earlier version (or an earlier hash scheme) don't linger
+        next to the new ones.
+        
+        Args:
+            document_name: Name of the re-indexed document
+            keep_ids: IDs of the chunks just added for it
+            
+        Returns:
+            True if successful
+        """
+        try:
+            keep = set(keep_ids)
+            stale = [chunk_id for chunk_id in self._document_ids(document_name)
+                     if chunk_id not in keep]
+            
+            if stale:
+                with self._write_lock:
+                    self.collection.delete(ids=stale)
+                    self.chunk_index.remove_ids(stale)
+                self._clear_result_cache()
+            return True
+            
+        except Exception as e:
+            _warn_sampled("delete", "Error removing stale chunks: %s", e)
+            return False
+    
+    def _document_ids(self, document_name: str) -> List[str]:
+        """All chunk IDs stored for a document"""
+        ids = self.chunk_index.ids_for(document_name)
+        if not ids or self.chunk_index.needs_backfill():
+            # Chunks from before the chunk index may not be in it yet
+            legacy_ids = self.collection.get(
+                where={"document_name": document_name},
+                include=[]
+            )['ids']
+            ids = list(dict.fromkeys(ids + legacy_ids))
+        return ids
+    
     def get_collection_stats(self) -> Dict:
         """
         Get statistics about the collection
@@ -188,23 +1039,66 @@ class VectorStore:
                 'collection_name': self.collection.name
             }
         except Exception as e:
-            print(f"Error getting stats: {e}")
+            _warn_sampled("stats", "Error getting stats: %s", e)
             return {'total_chunks': 0}
     
+    def _backfill_chunk_index(self):
+        """
+        Record the chunks the collection held before the chunk index existed
+        
+        Runs once per store. Without it, delete_document would only remove
+        a document's newer chunks and leave its older ones searchable.
+        """
+        try:
+            offset = 0
+            while True:
+                page = self.collection.get(
+                    include=["metadatas"],
+                    limit=BACKFILL_PAGE_SIZE,
+                    offset=offset
+                )
+                if not page['ids']:
+                    break
+                named = [
+                    (metadata['document_name'], chunk_id)
+                    for chunk_id, metadata in zip(page['ids'], page['metadatas'])
+                    if metadata and 'document_name' in metadata
+                ]
+                if named:
+                    self.chunk_index.add(*map(list, zip(*named)))
+                offset += len(page['ids'])
+            self.chunk_index.mark_backfilled()
+        except Exception as e:
+            # Left unmarked, so the next start tries again
+            _warn_sampled("backfill", "Error backfilling chunk index: %s", e)
+    
     def clear_collection(self) -> bool:
         """Clear all documents from collection"""
         try:
             self.client.delete_collection(name="documents")
-            self.collection = self.client.get_or_create_collection(
-                name="documents",
-                metadata={"description": "Arabic RAG document collection"}
-            )
+            self.chunk_index.clear()
+            self.collection = self._open_collection()
+            self._clear_result_cache()
             return True
         except Exception as e:
-            print(f"Error clearing collection: {e}")
+            _warn_sampled("clear", "Error clearing collection: %s", e)
             return False
 
 
+@functools.lru_cache(maxsize=1)
+def get_vector_store(persist_directory: str = "vectordb") -> VectorStore:
+    """
+    Process-wide VectorStore, so Chroma and its HNSW index are loaded once
+    
+    Args:
+        persist_directory: Directory to persist ChromaDB data
+        
+    Returns:
+        The shared VectorStore
+    """
+    return VectorStore(persist_directory)
+
+
 # Test function
 if __name__ == "__main__":
     # Test vector store